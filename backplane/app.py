@@ -1,32 +1,19 @@
 import os
-import validators
-from typing import List, Optional
-from pathlib import Path, PosixPath
-import anyconfig
-from git.repo.base import Repo
-from . import utils
-import sys
+from . import compose, metrics, trace
 import json
-from json import JSONEncoder
 import typer
-import subprocess
-from .config import Config
+from .config import Config, plain
+from .docker_client import get_client
+from .fingerprint import Fingerprint, project_name
+from .gitfetch import GitFetch, NotAWorktree
+from .pull import Puller, compose_images
 import datetime
-from read_version import read_version
-from .errors import (
-    ConfigNotFound,
-    ServiceNotFound,
-    CannotStartService,
-    CannotStopService,
-    CannotRemoveService,
-    CannotInstallApp,
-)
+import time
+from . import readiness
+from .errors import ConfigNotFound, CannotInstallApp
 
-
-class CustomEncoder(JSONEncoder):
-    def default(self, o):
-        if isinstance(o, PosixPath):
-            return str(o)
+# Seconds services of an app get to become ready after a deployment
+READY_TIMEOUT = 90
 
 
 class App:
@@ -38,6 +25,11 @@ class App:
         destination: str = None,
         config: Config = None,
         compose_file: str = None,
+        force: bool = False,
+        depth: int = None,
+        sparse: list = None,
+        ref: str = None,
+        engine: str = None,
     ):
         if config:
             self.config = config
@@ -61,8 +53,51 @@ class App:
 
         self.compose_file: str = compose_file
         self.registry_app: str = registry_app
+        self.force: bool = force
+        self.depth: int = depth
+        self.sparse: list = sparse
+        self.ref: str = ref
+        self.engine: str = engine or self.config.engine
+
+        if self.engine not in ("compose", "sdk"):
+            raise CannotInstallApp(f"Unknown engine {self.engine}")
 
     def install(self):
+        """
+        Install the app and record the outcome in the deployment metrics
+        """
+        started = time.monotonic()
+
+        try:
+            deployed = self._install()
+        except (Exception, CannotInstallApp, ConfigNotFound):
+            metrics.inc(
+                self.config, "backplane_deploys_total", app=self.name, result="failure"
+            )
+            raise
+
+        if deployed:
+            metrics.observe(
+                self.config,
+                "backplane_deploy_duration_seconds",
+                time.monotonic() - started,
+                app=self.name,
+            )
+        metrics.inc(
+            self.config,
+            "backplane_deploys_total",
+            app=self.name,
+            result="success" if deployed else "unchanged",
+        )
+
+        return deployed
+
+    def _install(self):
+        import asyncio
+        from . import process
+        from git import GitCommandError
+        from git.repo.base import Repo
+
         # First check if we need to install from the registry
         if self.registry_app:
             # Check if the app is in our config already
@@ -94,54 +129,49 @@ class App:
             # Loading app from external source
 
             app_path = self.destination
-            cwd = os.getcwd()
 
             try:
-                # Check if app already exists
-                if os.path.exists(app_path):
-                    typer.echo(f"found existing app in {app_path}")
-
-                    # Change to app_dir
-                    os.chdir(app_path)
-
-                    # Pull
-                    typer.echo(f"pulling updates from {self.source}")
+                fetcher = GitFetch(self.config, depth=self.depth, sparse=self.sparse)
+
+                try:
+                    if os.path.exists(app_path):
+                        typer.echo(f"found existing app in {app_path}")
+                    typer.echo(f"fetching from {self.source}")
+                    with trace.span("app.fetch", source=str(self.source)):
+                        fetcher.fetch(self.source, app_path, self.ref)
+                except NotAWorktree:
+                    # Installed by an earlier version with a full clone. Check
+                    # out detached, pulling would fail on the next push
+                    typer.echo(f"fetching updates from {self.source}")
                     repo = Repo(app_path)
-                    assert repo.__class__ is Repo
-
-                    repo.remotes.origin.pull()
-
-                    # Return to previous directory
-                    os.chdir(cwd)
-                else:
-                    typer.echo(f"cloning from {self.source}")
-                    try:
-                        repo = Repo.clone_from(self.source, app_path)
-                    except Exception as e:
-                        raise CannotInstallApp(f"Failed to clone from {self.source}: {e}")
-                assert repo.__class__ is Repo
+                    repo.remotes.origin.fetch()
+                    if not self.ref:
+                        repo.git.fetch("origin", "HEAD")
+                    repo.git.checkout("--force", "--detach", self.ref or "FETCH_HEAD")
+                except GitCommandError as e:
+                    raise CannotInstallApp(f"Failed to fetch from {self.source}: {e}")
 
                 # Set app path
                 self.path = app_path
 
                 # Set app name from git remote
-                remote_url = repo.remotes[0].config_reader.get(
-                    "url"
-                )  # e.g. 'https://github.com/abc123/MyRepo.git'
-                self.name = os.path.splitext(os.path.basename(remote_url))[0]  # 'MyRepo'
+                # e.g. 'https://github.com/abc123/MyRepo.git' -> 'MyRepo'
+                self.name = os.path.splitext(
+                    os.path.basename(str(self.source).rstrip("/"))
+                )[0]
             except Exception as e:
                 raise CannotInstallApp(f"Failed to install app from {self.source}: {e}")
 
         # Save app to user config
         try:
-            custom_config = {"apps": {}}
-            custom_config["apps"][self.name] = {
-                "destination": self.destination,
-                "source": self.source,
-                "params": {},
-            }
-
-            self.config.write(custom_config)
+            self.config.write_app(
+                self.name,
+                {
+                    "destination": self.destination,
+                    "source": self.source,
+                    "params": {},
+                },
+            )
             if self.config.verbose > 0:
                 typer.secho(
                     f"Saving new config to {self.config.config_path}",
@@ -169,38 +199,59 @@ class App:
 
             # Check existence of compose files
             compose_file = os.path.join(self.destination, self.compose_file)
-            app_config = {}
             if os.path.exists(compose_file):
                 install_command.append("-f")
                 install_command.append(str(compose_file))
 
                 # Load config
-                app_config = anyconfig.load(compose_file)
+                with trace.span("app.compose"):
+                    app_compose = compose.load(compose_file)
             else:
                 raise CannotInstallApp(f"{compose_file} not found")
 
             install_command.append("up")
             install_command.append("-d")
 
-            # Check if build is necessary
-            build = False
-
             # Augment
             os.environ["BUILD_DATE"] = datetime.datetime.utcnow().isoformat()
             # os.environ["BUILD_VERSION"]
             # BUILD_VERSION
             # VCS_REF
 
-            for service in app_config["services"]:
-                service_config = app_config["services"][service]
-                if "build" in service_config:
-                    build = True
+            # Skip or narrow down the deployment if inputs didn't change
+            fingerprint = Fingerprint(
+                self.config, self.name, self.destination, app_compose
+            )
+            with trace.span("app.fingerprint"):
+                current_fingerprint = fingerprint.compute()
+                services = list(app_compose.services)
+
+                if not self.force:
+                    services = fingerprint.changed(current_fingerprint)
+
+            if not services:
+                typer.echo(f"{self.name} is up to date, nothing to deploy.")
+                typer.echo(
+                    f"You can access your application at {','.join(self.getAppURLs())}"
+                )
+                return False
+
+            # Pull images concurrently instead of one after another
+            with trace.span("app.pull"):
+                Puller(self.config, compose_images(app_compose, services)).run()
 
-            if build:
+            # Check if build is necessary
+            if app_compose.build_services(services):
                 install_command.append("--build")
-                install_command.append("--force-recreate")
                 os.environ["DOCKER_BUILDKIT"] = "1"
 
+            if self.force:
+                install_command.append("--force-recreate")
+            elif len(services) < len(app_compose.services):
+                # Only build and recreate what changed, docker-compose
+                # leaves the other containers running
+                install_command += services
+
             if self.config.verbose > 0:
                 typer.secho(
                     f"Installation Command: {' '.join(install_command)}",
@@ -208,133 +259,196 @@ class App:
                     fg=typer.colors.BRIGHT_BLACK,
                 )
 
+            # Keep a copy of the deployment output
+            log_path = None
+            if self.config.deploy_logs:
+                log_dir = os.path.join(self.config.active_context_dir, "logs", self.name)
+                log_path = os.path.join(
+                    log_dir,
+                    f"{datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.log",
+                )
+                self.pruneLogs(log_dir, self.config.deploy_logs_keep - 1)
+                if self.config.verbose > 0:
+                    typer.secho(
+                        f"Logging deployment to {log_path}",
+                        err=False,
+                        fg=typer.colors.BRIGHT_BLACK,
+                    )
+
             # Start installation
             try:
-                result = subprocess.Popen(install_command, stdout=subprocess.PIPE)
-                while True:
-                    try:
-                        output = next(result.stdout)
-                        typer.echo(output.decode().strip())
-                    except StopIteration:
-                        # Get returncode from process
-                        result.communicate()[0]
-                        break
-
-                if result.returncode == 0:
+                started = time.monotonic()
+
+                with trace.span("app.deploy", engine=self.engine):
+                    if self.engine == "sdk" and self.deployNative(
+                        app_compose, env_file, services
+                    ):
+                        returncode = 0
+                    else:
+                        returncode = process.run(
+                            install_command,
+                            log_path=log_path,
+                            timestamps=bool(self.config.verbose),
+                        )
+
+                if returncode == 0:
+                    fingerprint.save(fingerprint.refresh(current_fingerprint, services))
+
                     typer.echo("Deployment complete.")
-                    typer.echo(
-                        f"You can access your application at {','.join(self.getAppURLs())}"
-                    )
+                    with trace.span("app.finish"):
+                        app_urls, ready = asyncio.run(
+                            self.finish(compose_file, services, started, log_path)
+                        )
+
+                    for service in sorted(ready):
+                        if ready[service] is None:
+                            typer.secho(
+                                f"{service} not ready after {READY_TIMEOUT}s",
+                                err=True,
+                                fg=typer.colors.RED,
+                            )
+                        else:
+                            typer.echo(f"{service} ready in {ready[service]:.1f}s")
 
-                    # Get logs
-                    if self.config.verbose:
-                        logs_command = [
-                            "docker-compose",
-                            "-p",
-                            self.name,
-                            "-f",
-                            compose_file,
-                            "logs",
-                            "--tail",
-                            "50",
-                        ]
-                        result = subprocess.Popen(logs_command, stdout=subprocess.PIPE)
-                        while True:
-                            try:
-                                output = next(result.stdout)
-                                typer.echo(output.decode().strip())
-                            except StopIteration:
-                                print("Logs complete.")
-                                break
+                    typer.echo(f"You can access your application at {','.join(app_urls)}")
+                    return True
                 else:
-                    raise CannotInstallApp(
-                        f"Deployment failed with code {result.returncode}."
-                    )
+                    raise CannotInstallApp(f"Deployment failed with code {returncode}.")
 
             except Exception as e:
                 raise CannotInstallApp(f"failed to install {self.name}: {e}")
         except Exception as e:
             raise CannotInstallApp(f"failed to install {self.name}: {e}")
 
-    def getAppURLs(self):
-        app_config = anyconfig.load(os.path.join(self.destination, self.compose_file))
-
-        protocol = "https" if self.config.https else "http"
-
-        app_urls = []
+    @staticmethod
+    def pruneLogs(log_dir: str, keep: int):
+        # Remove all but the newest keep deployment logs
+        try:
+            logs = sorted(name for name in os.listdir(log_dir) if name.endswith(".log"))
+        except FileNotFoundError:
+            return
 
-        for service in app_config["services"]:
-            service_name = service
+        for name in logs[: max(0, len(logs) - max(0, keep))]:
+            try:
+                os.remove(os.path.join(log_dir, name))
+            except OSError:
+                pass
 
-            service_config = app_config["services"][service]
+    def deployNative(self, app_compose, env_file: str, services: list):
+        """
+        Deploy services with the built-in engine. Returns False if the app
+        uses features that need docker-compose.
+        """
+        from .engine import Engine, Unsupported
 
-            if "labels" in service_config:
+        try:
+            engine = Engine(
+                self.config,
+                self.name,
+                app_compose,
+                env_file=env_file if os.path.exists(env_file) else None,
+            )
+            engine.check()
+        except Unsupported as e:
+            typer.secho(
+                f"Deploying with docker-compose, unsupported by the sdk engine: {e}",
+                err=False,
+                fg=typer.colors.BRIGHT_BLACK,
+            )
+            return False
 
-                for label in service_config["labels"]:
-                    key, value = label.split("=")
+        engine.deploy(
+            services,
+            recreate=self.force,
+            build=[service.name for service in app_compose.build_services(services)],
+        )
+        return True
 
-                    if key == "backplane.enabled":
-                        if value == "true":
-                            if self.config.verbose > 0:
-                                typer.secho(
-                                    f"backplane enabled for service {service_name}",
-                                    err=False,
-                                    fg=typer.colors.BRIGHT_BLACK,
-                                )
-                            app_urls.append(
-                                f"{protocol}://{service_name}.{self.config.domain}"
-                            )
+    async def finish(
+        self, compose_file: str, services: list, started: float, log_path: str = None
+    ):
+        """
+        Tail the logs of a deployment while looking up the URLs of the app
+        and waiting for the deployed services to become ready
+        """
+        import asyncio
+        from . import process
+
+        # Time to ready counts from started, but services only get their
+        # timeout once the deployment (including builds) is done
+        deadline = time.monotonic() + READY_TIMEOUT
+
+        loop = asyncio.get_running_loop()
+        app_urls = loop.run_in_executor(None, self.getAppURLs)
+        ready = loop.run_in_executor(None, self.waitForReady, services, started, deadline)
+
+        # Get logs
+        if self.config.verbose:
+            logs_command = [
+                "docker-compose",
+                "-p",
+                self.name,
+                "-f",
+                compose_file,
+                "logs",
+                "--tail",
+                "50",
+            ]
+            await process.Process(logs_command, log_path=log_path).run()
+            typer.echo("Logs complete.")
+
+        return await app_urls, await ready
+
+    @trace.traced("app.ready")
+    def waitForReady(self, services: list, started: float, deadline: float = None):
+        # Seconds from started until each service passed its healthcheck
+        # (or runs, if it has none)
+        # sparse=True avoids one inspect call per container, the probes
+        # reload what they need
+        containers = get_client().containers.list(
+            all=True,
+            sparse=True,
+            filters={"label": f"com.docker.compose.project={project_name(self.name)}"},
+        )
+
+        probes = {}
+        for container in containers:
+            labels = container.attrs.get("Labels") or {}
+            service = labels.get("com.docker.compose.service")
+            if service in services:
+                probes[service] = readiness.HealthcheckProbe(container)
+
+        return readiness.wait_for_probes(probes, READY_TIMEOUT, started, deadline)
+
+    @trace.traced("app.urls")
+    def getAppURLs(self):
+        app_compose = compose.load(os.path.join(self.destination, self.compose_file))
 
-        return app_urls
+        protocol = "https" if self.config.https else "http"
 
-    def serialize(self):
-        current_config = dict(self.__dict__)
-        return CustomEncoder().encode(current_config)
+        app_urls = []
 
-    def toJSON(self):
-        return self.serialize()
+        for service in app_compose.enabled_services():
+            if self.config.verbose > 0:
+                typer.secho(
+                    f"backplane enabled for service {service.name}",
+                    err=False,
+                    fg=typer.colors.BRIGHT_BLACK,
+                )
+            app_urls.append(f"{protocol}://{service.name}.{self.config.domain}")
 
-    def toDict(self):
-        return json.loads(self.serialize())
+        return app_urls
 
-    def load(self):
-        try:
-            if self.config_path.exists() and self.config_path.is_file():
-                current_config = self.toDict()
-                custom_config = anyconfig.load([str(self.config_path)])
-                anyconfig.merge(current_config, custom_config)
-
-                self.__dict__ = current_config
-                return current_config
-            # else:
-            #    raise ConfigNotFound
-            pass
-        except anyconfig.globals.UnknownFileTypeError as e:
-            raise ConfigNotFound(e)
-        except FileNotFoundError as e:
-            raise ConfigNotFound(e)
+    def to_dict(self):
+        return plain(
+            {
+                "name": self.name,
+                "source": self.source,
+                "destination": self.destination,
+                "compose_file": self.compose_file,
+                "registry_app": self.registry_app,
+            }
+        )
 
     def dump(self):
-        # Serialize as string by default (types like Path
-        # can't be serialized by JSONEncoder by default)
-        return json.dumps(dict(self.__dict__), indent=4, sort_keys=True, default=str)
-
-    def write(self):
-        try:
-            backplane_config = anyconfig.loads(json.dumps(config), ac_parser="json")
-            # anyconfig.merge(backplane_config, config)
-            # if os.path.exists(config_path):
-
-            # Open ~/.backplane/contexts/default/backplane.yml
-            # Save config as yml
-            with open(config_path, "w+") as writer:
-                writer.write(anyconfig.dumps(backplane_config, ac_parser="yaml"))
-
-            return backplane_config
-        except OSError as e:
-            typer.secho(
-                f"Couldn't write backplane config at {config_path}: {e}",
-                err=True,
-                fg=typer.colors.RED,
-            )
-            sys.exit(1)
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True)
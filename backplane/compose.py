@@ -0,0 +1,144 @@
+import os
+import threading
+
+# path -> (mtime_ns, size, ComposeFile)
+_cache = {}
+_lock = threading.Lock()
+
+
+def labels(value):
+    """
+    Labels as a dict, from either the list ("key=value") or the map syntax.
+    Only the first "=" separates key and value.
+    """
+    if not value:
+        return {}
+
+    if isinstance(value, dict):
+        return {
+            str(key): "" if label is None else str(label) for key, label in value.items()
+        }
+
+    result = {}
+    for label in value:
+        key, _, label_value = str(label).partition("=")
+        result[key.strip()] = label_value.strip()
+
+    return result
+
+
+def names(value):
+    # Keys of the map syntax or items of the list syntax
+    if not value:
+        return []
+
+    return [str(name) for name in value]
+
+
+class ComposeService:
+    """
+    A service of a compose file with normalized labels, build context,
+    networks and dependencies. The unmodified definition is kept in config.
+    """
+
+    __slots__ = ("name", "config", "image", "build", "labels", "networks", "depends_on")
+
+    def __init__(self, name: str, config: dict, base_dir: str):
+        self.name = name
+        self.config = config or {}
+        self.image = self.config.get("image")
+        self.labels = labels(self.config.get("labels"))
+        self.networks = names(self.config.get("networks"))
+        self.depends_on = names(self.config.get("depends_on"))
+        self.build = None
+
+        build = self.config.get("build")
+        if build is not None:
+            if not isinstance(build, dict):
+                build = {"context": build}
+            context = os.path.join(base_dir, str(build.get("context") or "."))
+            self.build = {
+                "context": os.path.realpath(context),
+                "dockerfile": build.get("dockerfile") or "Dockerfile",
+                "args": build.get("args") or {},
+            }
+
+    @property
+    def enabled(self):
+        return self.labels.get("backplane.enabled") == "true"
+
+    def dependencies(self):
+        # Services this service needs to be (re)created after
+        dependencies = set(self.depends_on)
+
+        for link in self.config.get("links") or []:
+            dependencies.add(link.split(":")[0])
+
+        for volumes_from in self.config.get("volumes_from") or []:
+            if not volumes_from.startswith("container:"):
+                dependencies.add(volumes_from.split(":")[0])
+
+        network_mode = self.config.get("network_mode") or ""
+        if network_mode.startswith("service:"):
+            dependencies.add(network_mode.split(":", 1)[1])
+
+        return dependencies
+
+
+class ComposeFile:
+    """
+    Parsed docker-compose file. Use load() to get a cached instance.
+    """
+
+    def __init__(self, path: str, config: dict):
+        self.path = str(path)
+        self.config = config or {}
+        base_dir = os.path.dirname(os.path.realpath(self.path))
+
+        self.services = {
+            name: ComposeService(name, service_config, base_dir)
+            for name, service_config in (self.config.get("services") or {}).items()
+        }
+        self.networks = {
+            name: network or {}
+            for name, network in (self.config.get("networks") or {}).items()
+        }
+        self.volumes = {
+            name: volume or {}
+            for name, volume in (self.config.get("volumes") or {}).items()
+        }
+
+    def build_services(self, services: list = None):
+        return [
+            service
+            for name, service in self.services.items()
+            if service.build and (services is None or name in services)
+        ]
+
+    def enabled_services(self):
+        return [service for service in self.services.values() if service.enabled]
+
+
+def load(path: str):
+    """
+    Parse a compose file once; later calls return the same model until
+    the file changes.
+    """
+    path = os.path.realpath(str(path))
+    file_stat = os.stat(path)
+    key = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+    # anyconfig loads all of its parser backends on import
+    import anyconfig
+
+    compose_file = ComposeFile(path, anyconfig.load(path) or {})
+
+    with _lock:
+        _cache[path] = (key, compose_file)
+
+    return compose_file
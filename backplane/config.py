@@ -1,21 +1,85 @@
+import copy
 import os
-from pathlib import Path, PosixPath
-import anyconfig
-import sys
+import pickle
+import stat
+from pathlib import Path, PurePath
 import json
-from json import JSONEncoder
 from .errors import ConfigNotFound
-import typer
+from . import trace, utils
 
 
-class CustomEncoder(JSONEncoder):
-    def default(self, o):
-        if isinstance(o, PosixPath):
-            return str(o)
+def plain(value):
+    # Convert a value into plain YAML/JSON types
+    if isinstance(value, PurePath):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+
+    return value
+
+
+def merge(target: dict, source: dict):
+    # Merge source into target: dicts are merged recursively,
+    # everything else is replaced
+    for key, value in (source or {}).items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+
+    return target
 
 
 class Config:
-    def __init__(self, config_path: Path = None):
+    __slots__ = (
+        "config_dir",
+        "default_context",
+        "active_context",
+        "mail",
+        "default_services",
+        "dependencies",
+        "parallelism",
+        "deploy_workers",
+        "git_depth",
+        "deploy_logs",
+        "deploy_logs_keep",
+        "engine",
+        "registry_mirror",
+        "metrics_port",
+        "apps",
+        "appstore_url",
+        "verbose",
+        "user",
+        "password",
+        "password_hash",
+        "template_url",
+        "ssh_public_key",
+        "ssh_public_key_file",
+        "https",
+        "domain",
+        "contexts_dir",
+        "default_context_dir",
+        "contexts",
+        "active_context_dir",
+        "config_path",
+        "app_dir",
+        "extra",
+    )
+
+    # Fields holding filesystem paths
+    paths = (
+        "config_dir",
+        "ssh_public_key_file",
+        "contexts_dir",
+        "default_context_dir",
+        "active_context_dir",
+        "config_path",
+        "app_dir",
+    )
+
+    def __init__(self, config_path: Path = None, load: bool = True):
         self.config_dir: Path = Path(
             os.getenv(
                 "BACKPLANE_CONFIG_DIR",
@@ -26,6 +90,15 @@ class Config:
         self.active_context: str = "default"
         self.mail: str = None
         self.default_services: list = ["traefik", "portainer", "backplane"]
+        self.dependencies: dict = {"portainer": ["traefik"]}
+        self.parallelism: int = 4
+        self.deploy_workers: int = 2
+        self.git_depth: int = 1
+        self.deploy_logs: bool = True
+        self.deploy_logs_keep: int = 10
+        self.engine: str = "compose"
+        self.registry_mirror: str = None
+        self.metrics_port: int = 9100
         self.apps: dict = {}
         self.appstore_url: str = "https://github.com/backplane-apps"
         self.verbose: bool = False
@@ -39,8 +112,8 @@ class Config:
         self.ssh_public_key_file: Path = Path(f"{os.getenv('HOME')}/.ssh/id_rsa.pub")
         self.https: bool = False
         self.domain: str = "127-0-0-1.ns0.co"
-        self.contexts_dir: Path = os.getenv(
-            "BACKPLANE_CONTEXTS_DIR", self.config_dir / "contexts"
+        self.contexts_dir: Path = Path(
+            os.getenv("BACKPLANE_CONTEXTS_DIR", self.config_dir / "contexts")
         )
         self.default_context_dir: Path = self.contexts_dir / self.default_context
         self.contexts: dict = {
@@ -51,78 +124,187 @@ class Config:
             }
         }
         self.active_context_dir: Path = self.default_context_dir
-        self.config_path: Path = (
+        self.config_path: Path = Path(
             config_path if config_path else self.active_context_dir / "backplane.yml"
         )
         self.app_dir: Path = Path(self.active_context_dir / "apps")
+        self.extra: dict = {}
 
-        self.load()
+        if load:
+            self.load()
 
-    def serialize(self, data=None):
-        if not data:
-            return CustomEncoder().encode(dict(self.__dict__))
-        else:
-            return CustomEncoder().encode(dict(data))
+    def __getattr__(self, name):
+        # Unknown keys from backplane.yml
+        if name != "extra":
+            try:
+                return self.extra[name]
+            except KeyError:
+                pass
 
-    def toJSON(self, data=None):
-        if not data:
-            return self.serialize()
-        else:
-            return self.serialize(data)
+        raise AttributeError(f"config has no attribute {name}")
 
-    def toDict(self, data=None):
-        if not data:
-            return json.loads(self.serialize())
-        else:
-            return json.loads(self.serialize(data))
+    @classmethod
+    def from_dict(cls, data: dict):
+        config = cls(load=False)
+        config.merge(data)
+        return config
 
-    def load(self):
+    def to_dict(self):
+        config = plain(self.extra)
+        for field in self.__slots__:
+            if field != "extra":
+                config[field] = plain(getattr(self, field))
+        return config
+
+    def merge(self, data: dict):
+        for key, value in (data or {}).items():
+            if key not in self.__slots__ or key == "extra":
+                merge(self.extra, {key: value})
+            elif key in self.paths:
+                setattr(self, key, Path(value) if value is not None else None)
+            elif isinstance(value, dict) and isinstance(getattr(self, key), dict):
+                merge(getattr(self, key), value)
+            else:
+                setattr(self, key, value)
+
+        return self
+
+    def cache_path(self):
+        return Path(self.active_context_dir) / ".backplane.yml.cache"
+
+    def read_cache(self, key: tuple):
         try:
-            if self.config_path.exists() and self.config_path.is_file():
-                current_config = self.toDict()
-                custom_config = anyconfig.load([str(self.config_path)])
-                anyconfig.merge(current_config, custom_config)
-
-                self.__dict__ = current_config
-                return current_config
-            # else:
-            #    raise ConfigNotFound
+            with open(self.cache_path(), "rb") as reader:
+                cached_key, cached_config = pickle.load(reader)
+            if cached_key == key:
+                return cached_config
+        except Exception:
             pass
-        except anyconfig.globals.UnknownFileTypeError as e:
-            raise ConfigNotFound(e)
-        except FileNotFoundError as e:
-            raise ConfigNotFound(e)
+
+        return None
+
+    def write_cache(self, key: tuple, config: dict):
+        cache_path = self.cache_path()
+        if not cache_path.parent.is_dir():
+            return
+
+        try:
+            utils.atomicWrite(
+                cache_path,
+                pickle.dumps((key, config), protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except OSError:
+            # The cache is an optimization only
+            pass
+
+    def load(self):
+        try:
+            config_stat = os.stat(self.config_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        if not stat.S_ISREG(config_stat.st_mode):
+            return None
+
+        with trace.span("config.load"):
+            custom_config = self.read_user_config(config_stat)
+            self.merge(custom_config)
+            return custom_config
+
+    def read_user_config(self, config_stat: os.stat_result = None):
+        # Parsed backplane.yml, served from the cache while it's unchanged
+        if config_stat is None:
+            try:
+                config_stat = os.stat(self.config_path)
+            except FileNotFoundError:
+                return {}
+
+        key = (str(self.config_path), config_stat.st_mtime_ns, config_stat.st_size)
+
+        # Merging into our defaults is cheap, parsing YAML is not
+        custom_config = self.read_cache(key)
+        if custom_config is None:
+            # anyconfig loads all of its parser backends on import
+            with trace.span("config.parse"):
+                import anyconfig
+
+                try:
+                    custom_config = anyconfig.load([str(self.config_path)]) or {}
+                except anyconfig.globals.UnknownFileTypeError as e:
+                    raise ConfigNotFound(e)
+                except FileNotFoundError as e:
+                    raise ConfigNotFound(e)
+
+            self.write_cache(key, custom_config)
+
+        return custom_config
 
     def dump(self):
-        # Serialize as string by default (types like Path
-        # can't be serialized by JSONEncoder by default)
-        return json.dumps(dict(self.__dict__), indent=4, sort_keys=True, default=str)
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True, default=str)
+
+    def lock(self):
+        return utils.fileLock(f"{self.config_path}.lock")
+
+    @trace.traced("config.write")
+    def persist(self, user_config: dict):
+        import anyconfig
+
+        utils.atomicWrite(
+            self.config_path,
+            anyconfig.dumps(user_config, ac_parser="yaml").encode(),
+        )
+
+        # Prime the cache so the next load doesn't parse what we just wrote
+        config_stat = os.stat(self.config_path)
+        self.write_cache(
+            (str(self.config_path), config_stat.st_mtime_ns, config_stat.st_size),
+            user_config,
+        )
 
     def write(self, custom_config: dict = None):
         # Note: this is only dealing with user config
-        if not os.path.exists(self.config_path):
-            # Create an empty config
-            with open(self.config_path, "a"):
-                os.utime(self.config_path, None)
         try:
-            if not custom_config:
-                backplane_config = anyconfig.loads(
-                    json.dumps(self.toDict()), ac_parser="json"
-                )
-            else:
-                # Only write user config, not the whole thing
-                user_config = anyconfig.load([str(self.config_path)])
-                anyconfig.merge(user_config, self.toDict(custom_config))
-                backplane_config = user_config
-            # anyconfig.merge(backplane_config, config)
-            # if os.path.exists(config_path):
+            with self.lock():
+                if not custom_config:
+                    backplane_config = self.to_dict()
+                else:
+                    # Only write user config, not the whole thing. Re-read it
+                    # under the lock so concurrent writers don't lose changes
+                    user_config = self.read_user_config()
+                    backplane_config = merge(
+                        copy.deepcopy(user_config), plain(custom_config)
+                    )
+                    if backplane_config == user_config:
+                        return backplane_config
 
-            # Open ~/.backplane/contexts/default/backplane.yml
-            # Save config as yml
-
-            with open(self.config_path, "w+") as writer:
-                writer.write(anyconfig.dumps(backplane_config, ac_parser="yaml"))
+                self.persist(backplane_config)
 
             return backplane_config
         except OSError as e:
             raise ConfigNotFound(e)
+
+    def write_app(self, name: str, app: dict):
+        """
+        Replace the entry of a single app in backplane.yml, leaving
+        everything else as it is on disk.
+        """
+        app = plain(app)
+
+        try:
+            with self.lock():
+                user_config = self.read_user_config()
+                apps = user_config.get("apps") or {}
+
+                if apps.get(name) != app:
+                    apps[name] = app
+                    user_config["apps"] = apps
+                    self.persist(user_config)
+        except OSError as e:
+            raise ConfigNotFound(e)
+
+        # "apps:" without a value loads as None
+        if self.apps is None:
+            self.apps = {}
+
+        self.apps[name] = app
+        return app
@@ -0,0 +1,213 @@
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+import typer
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .config import Config
+from . import metrics, utils
+
+
+def spool_dir(config: Config):
+    return Path(config.config_dir) / "queue"
+
+
+def enqueue(config: Config, name: str, source: str, ref: str = None):
+    """
+    Queue a deployment of app name. There is only ever one pending job per
+    app, so a newer push replaces a job that hasn't started yet.
+    """
+    queue = spool_dir(config)
+    queue.mkdir(parents=True, exist_ok=True)
+
+    job = {"name": name, "source": str(source), "ref": ref, "queued_at": time.time()}
+    job_path = queue / f"{name}.json"
+    utils.atomicWrite(job_path, json.dumps(job).encode())
+
+    return job_path
+
+
+def pid_path(config: Config):
+    return spool_dir(config) / "deployd.pid"
+
+
+def running(config: Config):
+    """
+    Check if a deployd process is alive for this config dir. deployd holds
+    a lock on its pid file while it runs; unlike the pid itself, the lock
+    can't go stale when the container restarts in a new pid namespace.
+    """
+    try:
+        with open(pid_path(config), "a") as pid_file:
+            try:
+                fcntl.flock(pid_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(pid_file.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+
+    return False
+
+
+class Deployd:
+    """
+    Works off queued deployments with a bounded number of concurrent
+    builds. Jobs for the same app never run concurrently; pushes that
+    arrive while an app is deploying are coalesced into one follow-up job.
+    """
+
+    def __init__(self, config: Config, workers: int = None, interval: float = 1.0):
+        self.config = config
+        self.workers = max(1, int(workers or config.deploy_workers))
+        self.interval = interval
+        self.queue = spool_dir(config)
+        self.active = {}
+
+    def recover(self):
+        # Requeue jobs that were interrupted by a restart, unless
+        # a newer push is already waiting
+        for working in self.queue.glob("*.working"):
+            job_path = working.with_suffix(".json")
+            if job_path.exists():
+                working.unlink()
+            else:
+                os.replace(working, job_path)
+
+    def claim(self):
+        jobs = sorted(self.queue.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        slots = self.workers - len(self.active)
+
+        for job_path in jobs:
+            name = job_path.stem
+            if slots <= 0:
+                break
+            if name in self.active:
+                continue
+
+            working = job_path.with_suffix(".working")
+            try:
+                os.replace(job_path, working)
+                with open(working) as reader:
+                    job = json.load(reader)
+            except (OSError, ValueError) as e:
+                typer.secho(
+                    f"Skipping broken deployment job {job_path}: {e}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+                continue
+
+            job["path"] = working
+            slots -= 1
+            yield job
+
+    def deploy(self, job: dict):
+        name = job["name"]
+        command = [
+            sys.executable,
+            "-m",
+            "backplane",
+            "install",
+            "--name",
+            name,
+            "--from",
+            job["source"],
+        ]
+        if job.get("ref"):
+            command += ["--ref", job["ref"]]
+
+        typer.echo(f"[{name}] deploying from {job['source']}")
+
+        if job.get("queued_at"):
+            metrics.observe(
+                self.config,
+                "backplane_deploy_queue_seconds",
+                max(0, time.time() - job["queued_at"]),
+                app=name,
+            )
+
+        try:
+            # Stream the output as it comes so docker logs follows the build
+            with subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            ) as process:
+                for line in process.stdout:
+                    typer.echo(f"[{name}] {line.decode(errors='replace').rstrip()}")
+                returncode = process.wait()
+
+            if returncode == 0:
+                typer.secho(f"[{name}] deployment complete", fg=typer.colors.GREEN)
+            else:
+                typer.secho(
+                    f"[{name}] deployment failed with code {returncode}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+
+            return returncode
+        finally:
+            try:
+                job["path"].unlink()
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        self.queue.mkdir(parents=True, exist_ok=True)
+
+        # Held until the process exits, see running()
+        pid_file = open(pid_path(self.config), "a")
+        try:
+            fcntl.flock(pid_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pid_file.close()
+            typer.secho(
+                f"deployd is already running for {self.queue}",
+                err=True,
+                fg=typer.colors.RED,
+            )
+            sys.exit(1)
+
+        pid_file.truncate(0)
+        pid_file.write(str(os.getpid()))
+        pid_file.flush()
+
+        self.recover()
+
+        typer.echo(f"deployd: watching {self.queue} with {self.workers} worker(s)")
+
+        if self.config.metrics_port:
+            try:
+                metrics.serve(self.config, background=True)
+                typer.echo(f"deployd: serving metrics on :{self.config.metrics_port}")
+            except OSError as e:
+                typer.secho(
+                    f"Unable to serve metrics on :{self.config.metrics_port}: {e}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    for name, future in list(self.active.items()):
+                        if future.done():
+                            self.active.pop(name)
+
+                            error = future.exception()
+                            if error:
+                                typer.secho(
+                                    f"[{name}] deployment crashed: {error}",
+                                    err=True,
+                                    fg=typer.colors.RED,
+                                )
+
+                    for job in self.claim():
+                        self.active[job["name"]] = executor.submit(self.deploy, job)
+
+                    time.sleep(self.interval)
+        finally:
+            pid_file.close()
@@ -0,0 +1,168 @@
+import contextlib
+import re
+import threading
+import typer
+from . import trace
+
+# Every parallel worker may hold a regular request and an events stream
+DEFAULT_POOL_SIZE = 8
+
+# Path parameters replaced in endpoints, e.g.
+# /v1.41/containers/4f2a.../json -> /containers/{id}/json
+ENDPOINTS = (
+    (re.compile(r"^/v[0-9.]+(?=/)"), ""),
+    (
+        re.compile(r"^/(containers|exec|networks)/(?!json$|create$|prune$)[^/]+"),
+        r"/\1/{id}",
+    ),
+    (re.compile(r"^/volumes/(?!create$|prune$)[^/]+"), "/volumes/{name}"),
+    (
+        re.compile(
+            r"^/images/(?!json$|create$|load$|search$|prune$|get$)"
+            r".+?(?=/json$|/tag$|/push$|/history$|/get$|$)"
+        ),
+        "/images/{name}",
+    ),
+    (re.compile(r"^/distribution/.+(?=/json$)"), "/distribution/{name}"),
+)
+
+_client = None
+_pool_size = DEFAULT_POOL_SIZE
+_lock = threading.Lock()
+
+# endpoint -> [calls, seconds]
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def configure(parallelism: int = None, pool_size: int = None):
+    """
+    Set the connection pool size of the shared client. Only has an effect
+    before the client has been created.
+    """
+    global _pool_size
+
+    if pool_size:
+        _pool_size = int(pool_size)
+    elif parallelism:
+        _pool_size = max(DEFAULT_POOL_SIZE, int(parallelism) * 2)
+
+
+def get_client():
+    """
+    Return the process-wide Docker client. All callers share its
+    keep-alive connection pool instead of building new sessions.
+    """
+    global _client
+
+    if _client is None:
+        with _lock:
+            if _client is None:
+                with trace.span("docker.connect"):
+                    import docker
+
+                    _client = docker.from_env(max_pool_size=_pool_size)
+                    _client.api.hooks["response"].append(_record)
+
+    return _client
+
+
+def reset():
+    global _client
+
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+def endpoint(method: str, path: str):
+    for pattern, replacement in ENDPOINTS:
+        path = pattern.sub(replacement, path)
+
+    return f"{method} {path}"
+
+
+def _record(response, *args, **kwargs):
+    # Response hook of the API client. The latency is the time until the
+    # response headers arrived, streams (pulls, events) aren't included
+    from urllib.parse import urlparse
+
+    request = response.request
+    name = endpoint(request.method, urlparse(request.url).path)
+
+    with _calls_lock:
+        call = _calls.setdefault(name, [0, 0.0])
+        call[0] += 1
+        call[1] += response.elapsed.total_seconds()
+
+
+def calls():
+    """
+    Docker API calls made by the shared client so far, as
+    {endpoint: (calls, seconds)}. The version negotiation while connecting
+    is not included.
+    """
+    with _calls_lock:
+        return {name: tuple(call) for name, call in _calls.items()}
+
+
+def reset_calls():
+    with _calls_lock:
+        _calls.clear()
+
+
+def report():
+    # Print the API calls per endpoint, most frequent first
+    made = calls()
+    if not made:
+        return
+
+    total = sum(count for count, seconds in made.values())
+    seconds = sum(seconds for count, seconds in made.values())
+    typer.secho(
+        f"Docker API: {total} calls, {seconds * 1000:.1f} ms",
+        err=True,
+        fg=typer.colors.BRIGHT_BLACK,
+    )
+    for name, (count, seconds) in sorted(made.items(), key=lambda item: -item[1][0]):
+        typer.secho(
+            f"  {name:<48} {count:>5} {seconds * 1000:>10.1f} ms",
+            err=True,
+            fg=typer.colors.BRIGHT_BLACK,
+        )
+
+
+@contextlib.contextmanager
+def api_budget(total: int = None, endpoints: dict = None):
+    """
+    Assert that the block makes at most total Docker API calls, and at
+    most endpoints[endpoint] calls per endpoint:
+
+        with api_budget(1, {"GET /containers/json": 1}):
+            Snapshot(config)
+
+    Raises AssertionError listing the calls otherwise.
+    """
+    before = calls()
+    yield
+
+    made = {}
+    for name, (count, seconds) in calls().items():
+        count -= before.get(name, (0, 0.0))[0]
+        if count:
+            made[name] = count
+
+    exceeded = [
+        f"{name}: {made.get(name, 0)} > {limit}"
+        for name, limit in (endpoints or {}).items()
+        if made.get(name, 0) > limit
+    ]
+    if total is not None and sum(made.values()) > total:
+        exceeded.insert(0, f"total: {sum(made.values())} > {total}")
+
+    if exceeded:
+        breakdown = ", ".join(f"{name} x{count}" for name, count in sorted(made.items()))
+        raise AssertionError(
+            f"Docker API budget exceeded ({'; '.join(exceeded)}). Calls: {breakdown}"
+        )
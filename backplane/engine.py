@@ -0,0 +1,506 @@
+import copy
+import os
+import re
+import typer
+from .compose import ComposeFile
+from .config import Config
+from .docker_client import get_client
+from .fingerprint import digest, project_name
+from .orchestrator import Orchestrator
+from .errors import CannotInstallApp
+
+TOP_LEVEL_KEYS = {"version", "services", "networks", "volumes"}
+SERVICE_KEYS = {
+    "build",
+    "cap_add",
+    "cap_drop",
+    "command",
+    "container_name",
+    "depends_on",
+    "entrypoint",
+    "env_file",
+    "environment",
+    "expose",
+    "extra_hosts",
+    "hostname",
+    "image",
+    "labels",
+    "networks",
+    "ports",
+    "privileged",
+    "restart",
+    "stdin_open",
+    "tty",
+    "user",
+    "volumes",
+    "working_dir",
+}
+NETWORK_KEYS = {
+    "driver",
+    "driver_opts",
+    "external",
+    "name",
+    "labels",
+    "internal",
+    "attachable",
+}
+VOLUME_KEYS = {"driver", "driver_opts", "external", "name", "labels"}
+
+VARIABLE = re.compile(
+    r"\$(?:(?P<escaped>\$)"
+    r"|\{(?P<braced>[A-Za-z_][A-Za-z0-9_]*)(?:(?P<separator>:?[-?])(?P<default>[^}]*))?\}"
+    r"|(?P<named>[A-Za-z_][A-Za-z0-9_]*))"
+)
+
+
+class Unsupported(Exception):
+    """Raised when a compose file uses features the engine can't deploy"""
+
+    pass
+
+
+def interpolate(value, environment: dict):
+    """
+    Substitute $VAR, ${VAR}, ${VAR-default} and ${VAR:-default} in all
+    strings of value the way docker-compose does.
+    """
+    if isinstance(value, dict):
+        return {key: interpolate(item, environment) for key, item in value.items()}
+    if isinstance(value, list):
+        return [interpolate(item, environment) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    def substitute(match):
+        if match.group("escaped"):
+            return "$"
+
+        name = match.group("braced") or match.group("named")
+        separator = match.group("separator")
+        variable = environment.get(name)
+
+        if separator and "?" in separator:
+            raise Unsupported(f"required variable syntax for {name}")
+        if separator == ":-" and not variable:
+            return match.group("default")
+        if separator == "-" and variable is None:
+            return match.group("default")
+
+        return variable or ""
+
+    return VARIABLE.sub(substitute, value)
+
+
+def read_env_file(path: str, expand: bool = True):
+    from dotenv import dotenv_values
+
+    return {
+        key: "" if value is None else value
+        for key, value in dotenv_values(path, interpolate=expand).items()
+    }
+
+
+class Engine:
+    """
+    Deploys a compose file with the Docker SDK instead of forking
+    docker-compose. Containers, networks and volumes are named and labeled
+    like docker-compose does, so both can be used on the same app.
+    Independent services are created in parallel.
+    """
+
+    def __init__(
+        self, config: Config, name: str, compose: ComposeFile, env_file: str = None
+    ):
+        self.config = config
+        self.project = project_name(name)
+        self.base_dir = os.path.dirname(compose.path)
+
+        environment = read_env_file(env_file) if env_file else {}
+        environment.update(os.environ)
+
+        # A copy with variables substituted, the cached model stays untouched
+        self.compose = ComposeFile(
+            compose.path, interpolate(copy.deepcopy(compose.config), environment)
+        )
+
+    @property
+    def client(self):
+        return get_client()
+
+    def check(self):
+        """
+        Raise Unsupported if the compose file needs docker-compose.
+        """
+        for key in self.compose.config:
+            if key not in TOP_LEVEL_KEYS:
+                raise Unsupported(f"top-level key {key}")
+
+        for name, network in self.compose.networks.items():
+            for key in network:
+                if key not in NETWORK_KEYS:
+                    raise Unsupported(f"network {name}: {key}")
+
+        for name, volume in self.compose.volumes.items():
+            for key in volume:
+                if key not in VOLUME_KEYS:
+                    raise Unsupported(f"volume {name}: {key}")
+
+        for name, service in self.compose.services.items():
+            for key in service.config:
+                if key not in SERVICE_KEYS:
+                    raise Unsupported(f"service {name}: {key}")
+
+            depends_on = service.config.get("depends_on")
+            if isinstance(depends_on, dict):
+                for dependency in depends_on.values():
+                    condition = (dependency or {}).get("condition", "service_started")
+                    if condition != "service_started":
+                        raise Unsupported(f"service {name}: depends_on {condition}")
+
+            networks = service.config.get("networks")
+            if isinstance(networks, dict):
+                for network in networks.values():
+                    if set(network or {}) - {"aliases"}:
+                        raise Unsupported(f"service {name}: network options")
+
+            for volume in service.config.get("volumes") or []:
+                if not isinstance(volume, str):
+                    raise Unsupported(f"service {name}: long volume syntax")
+
+            for port in service.config.get("ports") or []:
+                if not isinstance(port, (str, int)) or "-" in str(port):
+                    raise Unsupported(f"service {name}: port {port}")
+
+            if not service.image and not service.build:
+                raise Unsupported(f"service {name}: neither image nor build")
+
+    def labels(self, **labels):
+        labels = {f"com.docker.compose.{key}": value for key, value in labels.items()}
+        labels["com.docker.compose.project"] = self.project
+        return labels
+
+    def network_name(self, network: str):
+        spec = self.compose.networks.get(network) or {}
+        external = spec.get("external")
+        if isinstance(external, dict):
+            return external.get("name") or network
+        if external:
+            return spec.get("name") or network
+
+        return spec.get("name") or f"{self.project}_{network}"
+
+    def volume_name(self, volume: str):
+        spec = self.compose.volumes.get(volume) or {}
+        external = spec.get("external")
+        if isinstance(external, dict):
+            return external.get("name") or volume
+        if external:
+            return spec.get("name") or volume
+
+        return spec.get("name") or f"{self.project}_{volume}"
+
+    def service_networks(self, service):
+        networks = service.config.get("networks")
+        if not networks:
+            return {"default": []}
+        if isinstance(networks, dict):
+            return {
+                network: list((options or {}).get("aliases") or [])
+                for network, options in networks.items()
+            }
+
+        return {network: [] for network in networks}
+
+    def ensure_networks(self):
+        used = set()
+        for service in self.compose.services.values():
+            used.update(self.service_networks(service))
+
+        for network in sorted(used):
+            spec = self.compose.networks.get(network) or {}
+            name = self.network_name(network)
+
+            if any(n.name == name for n in self.client.networks.list(names=[name])):
+                continue
+            if spec.get("external"):
+                raise CannotInstallApp(f"external network {name} not found")
+
+            self.client.networks.create(
+                name,
+                driver=spec.get("driver"),
+                options=spec.get("driver_opts"),
+                internal=bool(spec.get("internal")),
+                attachable=bool(spec.get("attachable")),
+                labels={**(spec.get("labels") or {}), **self.labels(network=network)},
+            )
+
+    def ensure_volumes(self):
+        from docker.errors import NotFound
+
+        for volume, spec in self.compose.volumes.items():
+            name = self.volume_name(volume)
+            try:
+                self.client.volumes.get(name)
+                continue
+            except NotFound:
+                if spec.get("external"):
+                    raise CannotInstallApp(f"external volume {name} not found")
+
+            self.client.volumes.create(
+                name,
+                driver=spec.get("driver") or "local",
+                driver_opts=spec.get("driver_opts"),
+                labels={**(spec.get("labels") or {}), **self.labels(volume=volume)},
+            )
+
+    def image(self, service, build: bool):
+        """
+        Build or pull the image of a service if necessary. Returns the
+        reference and the image.
+        """
+        from docker.errors import ImageNotFound
+        from docker.utils import parse_repository_tag
+
+        if service.build:
+            reference = service.image or f"{self.project}_{service.name}"
+            if not build:
+                try:
+                    return reference, self.client.images.get(reference)
+                except ImageNotFound:
+                    pass
+
+            image, _ = self.client.images.build(
+                path=service.build["context"],
+                dockerfile=service.build["dockerfile"],
+                buildargs={k: str(v) for k, v in service.build["args"].items()},
+                tag=reference,
+                rm=True,
+            )
+            return reference, image
+
+        try:
+            return service.image, self.client.images.get(service.image)
+        except ImageNotFound:
+            repository, tag = parse_repository_tag(service.image)
+            return service.image, self.client.images.pull(repository, tag=tag or "latest")
+
+    def environment(self, service):
+        environment = {}
+
+        env_files = service.config.get("env_file") or []
+        if isinstance(env_files, str):
+            env_files = [env_files]
+        for env_file in env_files:
+            environment.update(
+                read_env_file(os.path.join(self.base_dir, env_file), expand=False)
+            )
+
+        variables = service.config.get("environment") or {}
+        if isinstance(variables, list):
+            variables = dict(
+                v.split("=", 1) if "=" in v else (v, os.environ.get(v)) for v in variables
+            )
+        for key, value in variables.items():
+            if value is None:
+                value = os.environ.get(key)
+            if value is not None:
+                environment[key] = str(value)
+
+        return environment
+
+    def mounts(self, service):
+        volumes = []
+        binds = []
+
+        for volume in service.config.get("volumes") or []:
+            parts = volume.split(":")
+            if len(parts) == 1:
+                # Anonymous volume
+                volumes.append(parts[0])
+                continue
+
+            source, target = parts[0], parts[1]
+            mode = parts[2] if len(parts) > 2 else "rw"
+
+            if source.startswith((".", "/", "~")):
+                source = os.path.realpath(
+                    os.path.join(self.base_dir, os.path.expanduser(source))
+                )
+            else:
+                source = self.volume_name(source)
+
+            volumes.append(target)
+            binds.append(f"{source}:{target}:{mode}")
+
+        return volumes, binds
+
+    def ports(self, service):
+        ports = []
+        bindings = {}
+
+        for port in service.config.get("expose") or []:
+            port, _, protocol = str(port).partition("/")
+            ports.append((int(port), protocol or "tcp"))
+
+        for port in service.config.get("ports") or []:
+            port, _, protocol = str(port).partition("/")
+            protocol = protocol or "tcp"
+            parts = port.rsplit(":", 2)
+            container_port = int(parts[-1])
+
+            if len(parts) == 3:
+                binding = (parts[0], int(parts[1]) if parts[1] else None)
+            elif len(parts) == 2:
+                binding = int(parts[0])
+            else:
+                binding = None
+
+            ports.append((container_port, protocol))
+            bindings.setdefault(f"{container_port}/{protocol}", []).append(binding)
+
+        return ports, bindings
+
+    @staticmethod
+    def restart_policy(restart: str):
+        if not restart or restart == "no":
+            return None
+
+        name, _, retries = str(restart).partition(":")
+        return {"Name": name, "MaximumRetryCount": int(retries or 0)}
+
+    def container_name(self, service):
+        return service.config.get("container_name") or f"{self.project}_{service.name}_1"
+
+    def existing(self, name: str):
+        from docker.errors import NotFound
+
+        try:
+            return self.client.containers.get(name)
+        except NotFound:
+            return None
+
+    def up(self, name: str, recreate: bool = False, build: bool = False):
+        """
+        Create and start the container of a service. Returns what was done.
+        """
+        service = self.compose.services[name]
+        container_name = self.container_name(service)
+        environment = self.environment(service)
+        config_hash = digest(service.config, environment)
+
+        reference, image = self.image(service, build)
+
+        # Converge like docker-compose: keep containers whose configuration
+        # and image didn't change
+        container = self.existing(container_name)
+        if container:
+            labels = container.labels or {}
+            if (
+                not recreate
+                and labels.get("com.docker.compose.config-hash") == config_hash
+                and container.attrs.get("Image") == image.id
+            ):
+                if container.status == "running":
+                    return "up-to-date"
+                container.start()
+                return "started"
+
+            container.stop(timeout=10)
+            container.remove()
+
+        volumes, binds = self.mounts(service)
+        ports, port_bindings = self.ports(service)
+        networks = self.service_networks(service)
+
+        api = self.client.api
+        host_config = api.create_host_config(
+            binds=binds,
+            port_bindings=port_bindings,
+            restart_policy=self.restart_policy(service.config.get("restart")),
+            privileged=bool(service.config.get("privileged")),
+            cap_add=service.config.get("cap_add"),
+            cap_drop=service.config.get("cap_drop"),
+            extra_hosts=service.config.get("extra_hosts"),
+            network_mode=self.network_name(next(iter(networks))),
+        )
+
+        first, *others = networks.items()
+        created = api.create_container(
+            reference,
+            name=container_name,
+            command=service.config.get("command"),
+            entrypoint=service.config.get("entrypoint"),
+            environment=environment,
+            labels={
+                **service.labels,
+                **self.labels(
+                    service=name,
+                    **{
+                        "container-number": "1",
+                        "oneoff": "False",
+                        "config-hash": config_hash,
+                        "project.working_dir": self.base_dir,
+                        "project.config_files": self.compose.path,
+                    },
+                ),
+            },
+            hostname=service.config.get("hostname"),
+            working_dir=service.config.get("working_dir"),
+            user=service.config.get("user"),
+            tty=bool(service.config.get("tty")),
+            stdin_open=bool(service.config.get("stdin_open")),
+            ports=ports,
+            volumes=volumes,
+            host_config=host_config,
+            networking_config=api.create_networking_config(
+                {
+                    self.network_name(first[0]): api.create_endpoint_config(
+                        aliases=[name, *first[1]]
+                    )
+                }
+            ),
+        )
+
+        for network, aliases in others:
+            api.connect_container_to_network(
+                created["Id"], self.network_name(network), aliases=[name, *aliases]
+            )
+
+        api.start(created["Id"])
+        return "recreated" if container else "created"
+
+    def deploy(self, services: list = None, recreate: bool = False, build: list = None):
+        """
+        Deploy services (default: all) along their dependencies. Services
+        listed in build get their images rebuilt.
+        """
+        services = list(services or self.compose.services)
+        build = set(build or [])
+
+        self.ensure_networks()
+        self.ensure_volumes()
+
+        orchestrator = Orchestrator(
+            services,
+            dependencies={
+                name: service.dependencies()
+                for name, service in self.compose.services.items()
+            },
+            parallelism=self.config.parallelism,
+        )
+
+        def report(name, result, error):
+            if error is None:
+                typer.echo(f"{self.container_name(self.compose.services[name])} {result}")
+
+        results, failures = orchestrator.run(
+            lambda name: self.up(name, recreate=recreate, build=name in build),
+            on_done=report,
+        )
+
+        if failures:
+            raise CannotInstallApp(
+                ", ".join(f"{name}: {error}" for name, error in sorted(failures.items()))
+            )
+
+        return results
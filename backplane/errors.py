@@ -32,3 +32,21 @@ class CannotInstallApp(BaseException):
     """Raised when an app can't be installed"""
 
     pass
+
+
+class CannotResolveDependencies(BaseException):
+    """Raised when the service dependency graph can't be resolved"""
+
+    pass
+
+
+class DependencyFailed(BaseException):
+    """Raised when a service is skipped because a dependency failed"""
+
+    pass
+
+
+class CannotPullImage(BaseException):
+    """Raised when an image can't be pulled"""
+
+    pass
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from .compose import ComposeFile
+from .config import Config
+from .docker_client import get_client
+from . import utils
+
+
+def digest(*parts):
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode()
+        sha.update(part)
+        sha.update(b"\0")
+
+    return sha.hexdigest()
+
+
+def file_digest(path: str):
+    try:
+        with open(path, "rb") as reader:
+            return digest(reader.read())
+    except FileNotFoundError:
+        return None
+
+
+def project_name(name: str):
+    # docker-compose normalizes project names the same way
+    return re.sub(r"[^-_a-z0-9]", "", name.lower())
+
+
+class Fingerprint:
+    """
+    Hashes everything a deployment of an app depends on: the compose file,
+    the .env file, build contexts and local image digests. Fingerprints
+    are kept per service so a redeploy can be skipped or narrowed down to
+    the services whose inputs changed.
+    """
+
+    def __init__(self, config: Config, name: str, destination: str, compose: ComposeFile):
+        self.config = config
+        self.name = name
+        self.destination = str(destination)
+        self.compose = compose
+        self.path = Path(config.active_context_dir) / "fingerprints" / f"{name}.json"
+
+    def repo(self):
+        try:
+            from git import InvalidGitRepositoryError, NoSuchPathError
+            from git.repo.base import Repo
+
+            return Repo(self.destination, search_parent_directories=True)
+        except (InvalidGitRepositoryError, NoSuchPathError):
+            return None
+
+    def head(self, repo=None):
+        try:
+            return repo.head.commit.hexsha if repo else None
+        except ValueError:
+            # Repository without commits
+            return None
+
+    def context(self, build: dict, repo=None):
+        """
+        Digest of a build context. Uses the git tree hash if the context is
+        committed and clean, otherwise hashes the files in the context.
+        """
+        context_path = build["context"]
+        dockerfile_digest = file_digest(os.path.join(context_path, build["dockerfile"]))
+
+        if repo and self.head(repo):
+            root = os.path.realpath(repo.working_tree_dir)
+            relative = os.path.relpath(context_path, root)
+
+            if not relative.startswith(".."):
+                relative = "" if relative == "." else relative
+                try:
+                    if not repo.is_dirty(untracked_files=True, path=relative or None):
+                        tree = repo.git.rev_parse(f"HEAD:{relative}")
+                        return digest(tree, dockerfile_digest)
+                except Exception:
+                    pass
+
+        files = []
+        for directory, directories, filenames in os.walk(context_path):
+            directories[:] = sorted(d for d in directories if d != ".git")
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                files.append((os.path.relpath(path, context_path), file_digest(path)))
+
+        return digest(files, dockerfile_digest)
+
+    def image(self, reference: str):
+        from docker.errors import ImageNotFound
+
+        try:
+            return get_client().images.get(reference).id
+        except ImageNotFound:
+            return None
+
+    def shared(self):
+        # Top-level networks, volumes etc. and the .env file affect all services
+        return digest(
+            file_digest(os.path.join(self.destination, ".env")),
+            {
+                key: value
+                for key, value in self.compose.config.items()
+                if key != "services"
+            },
+        )
+
+    def compute(self):
+        shared = self.shared()
+        repo = self.repo()
+
+        fingerprints = {}
+        for name, service in self.compose.services.items():
+            if service.build:
+                fingerprints[name] = digest(
+                    shared, service.config, self.context(service.build, repo)
+                )
+            else:
+                fingerprints[name] = digest(
+                    shared,
+                    service.config,
+                    self.image(service.image) if service.image else None,
+                )
+
+        return {"services": fingerprints}
+
+    def refresh(self, fingerprint: dict, services: list):
+        """
+        Update the image ids of services that were pulled during the
+        deployment, compute() only saw what was there before.
+        """
+        shared = self.shared()
+        fingerprints = dict(fingerprint["services"])
+
+        for name in services:
+            service = self.compose.services[name]
+            if service.image and not service.build:
+                fingerprints[name] = digest(
+                    shared, service.config, self.image(service.image)
+                )
+
+        return dict(fingerprint, services=fingerprints)
+
+    def load(self):
+        try:
+            with open(self.path) as reader:
+                return json.load(reader)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, fingerprint: dict):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        utils.atomicWrite(self.path, json.dumps(fingerprint, indent=2).encode())
+
+    def running(self):
+        # Services of the compose project that have a usable container
+        docker_client = get_client()
+        containers = docker_client.containers.list(
+            all=True,
+            sparse=True,
+            filters={"label": f"com.docker.compose.project={project_name(self.name)}"},
+        )
+
+        services = set()
+        for container in containers:
+            labels = container.attrs.get("Labels") or {}
+            status = container.attrs.get("Status") or ""
+
+            # One-shot services that exited cleanly count as deployed
+            if container.status == "running" or status.startswith("Exited (0)"):
+                services.add(labels.get("com.docker.compose.service"))
+
+        return services
+
+    def dependents(self, services: list):
+        """
+        Expand services with everything that depends on them, directly or
+        through other services.
+        """
+        dependencies = {
+            name: service.dependencies()
+            for name, service in self.compose.services.items()
+        }
+
+        result = list(services)
+        for service in result:
+            for dependent, requires in dependencies.items():
+                if service in requires and dependent not in result:
+                    result.append(dependent)
+
+        return result
+
+    def changed(self, fingerprint: dict):
+        """
+        Return the services that need to be deployed given the new
+        fingerprint, including their dependents.
+        """
+        previous = self.load().get("services") or {}
+        running = self.running()
+
+        return self.dependents(
+            [
+                service
+                for service, current in fingerprint["services"].items()
+                if previous.get(service) != current or service not in running
+            ]
+        )
@@ -0,0 +1,123 @@
+import hashlib
+import os
+from pathlib import Path
+from .config import Config
+from . import utils
+
+
+class NotAWorktree(Exception):
+    """Raised when a destination exists but isn't managed by GitFetch"""
+
+    pass
+
+
+class GitFetch:
+    """
+    Fetches apps through a shared bare mirror per source under
+    <config_dir>/cache/git. Mirrors are shallow by default (git_depth) and
+    app checkouts are worktrees of their mirror, so reinstalling an app or
+    installing it into several contexts only transfers new objects and
+    never copies them.
+    """
+
+    def __init__(self, config: Config, depth: int = None, sparse: list = None):
+        self.config = config
+        self.depth = config.git_depth if depth is None else depth
+        self.sparse = list(sparse or [])
+        self.cache_dir = Path(config.config_dir) / "cache" / "git"
+
+    def mirror_path(self, source: str):
+        name = os.path.splitext(os.path.basename(str(source).rstrip("/")))[0]
+        key = hashlib.sha1(str(source).encode()).hexdigest()[:12]
+        return self.cache_dir / f"{name}-{key}.git"
+
+    def depth_args(self):
+        return ["--depth", str(self.depth)] if self.depth else []
+
+    def update(self, source: str):
+        from git import Git
+
+        mirror = self.mirror_path(source)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        with utils.fileLock(f"{mirror}.lock"):
+            if not mirror.exists():
+                Git().clone("--bare", *self.depth_args(), str(source), str(mirror))
+            else:
+                Git(str(mirror)).fetch(
+                    "--prune",
+                    *self.depth_args(),
+                    "origin",
+                    "+refs/heads/*:refs/heads/*",
+                )
+
+        return mirror
+
+    @staticmethod
+    def is_bare(path: str):
+        # A bare repository on this host, e.g. one that received a push
+        path = str(path)
+        return (
+            os.path.isfile(os.path.join(path, "HEAD"))
+            and os.path.isdir(os.path.join(path, "objects"))
+            and not os.path.exists(os.path.join(path, ".git"))
+        )
+
+    @staticmethod
+    def worktree_of(destination: str):
+        # The gitdir a worktree checkout points to, if any
+        dot_git = os.path.join(destination, ".git")
+        if not os.path.isfile(dot_git):
+            return None
+
+        with open(dot_git) as reader:
+            line = reader.read().strip()
+
+        if not line.startswith("gitdir:"):
+            return None
+
+        return Path(line[len("gitdir:") :].strip())
+
+    def checkout(self, mirror: Path, destination: str, ref: str = "HEAD"):
+        """
+        Check out ref of mirror into destination. Existing worktrees are
+        moved to the new commit, which only rewrites files that changed.
+        """
+        from git import Git
+
+        destination = str(destination)
+        mirror_git = Git(str(mirror))
+        commit = mirror_git.rev_parse(f"{ref}^{{commit}}")
+
+        if os.path.exists(destination):
+            worktree = self.worktree_of(destination)
+            if not worktree or worktree.parent.parent.resolve() != mirror.resolve():
+                raise NotAWorktree(f"{destination} is not a worktree of {mirror}")
+
+            worktree_git = Git(destination)
+            if self.sparse:
+                worktree_git.sparse_checkout("set", "--no-cone", *self.sparse)
+            worktree_git.checkout("--force", "--detach", commit)
+            return commit
+
+        with utils.fileLock(f"{mirror}.lock"):
+            # Forget worktrees whose directories have been deleted
+            mirror_git.worktree("prune")
+            mirror_git.worktree("add", "--detach", "--no-checkout", destination, commit)
+
+        worktree_git = Git(destination)
+        if self.sparse:
+            worktree_git.sparse_checkout("set", "--no-cone", *self.sparse)
+        worktree_git.checkout("--force", "--detach", commit)
+
+        return commit
+
+    def fetch(self, source: str, destination: str, ref: str = None):
+        ref = ref or "HEAD"
+
+        # Local bare repositories already have all objects, check out
+        # straight from them instead of going through a mirror
+        if self.is_bare(source):
+            return self.checkout(Path(source), destination, ref)
+
+        return self.checkout(self.update(source), destination, ref)
@@ -6,15 +6,18 @@ from shutil import which
 import sys
 from typing import Optional, List
 from pathlib import Path
-from read_version import read_version
+from backplane import __version__
 from backplane import utils
 from backplane.config import Config
 from backplane.app import App
 from backplane.service import Service
-from backplane.errors import ConfigNotFound, CannotStartService
-from requests import get
-import subprocess
-from git.repo.base import Repo
+from backplane.snapshot import Snapshot
+from backplane import docker_client
+from backplane import trace
+from backplane.errors import (
+    ConfigNotFound,
+    CannotResolveDependencies,
+)
 
 # Linux
 # ('Linux', '5.4.0-52-generic', '#57-Ubuntu SMP Thu Oct 15 10:57:00 UTC 2020')
@@ -110,6 +113,8 @@ def init(
     if domain:
         backplane_config["domain"] = domain
     else:
+        from requests import get
+
         backplane_config[
             "domain"
         ] = f"{get('https://api.ipify.org').text.replace('.','-')}.ns0.co"
@@ -121,6 +126,8 @@ def init(
         backplane_config["password"] = password
 
         # Generate password hash
+        import subprocess
+
         try:
             password_hash = subprocess.run(
                 ["htpasswd", "-nbB", user, password], stdout=subprocess.PIPE
@@ -147,7 +154,7 @@ def init(
         backplane_config["ssh_public_key_file"] = ssh_public_key_file
 
     if backplane_config:
-        utils.writeConfig(backplane_config_dir, backplane_config)
+        conf.write(backplane_config)
         if conf.verbose > 0:
             typer.secho(
                 f"Saving new config to {backplane_config_dir}",
@@ -171,7 +178,7 @@ def rm(
     """
 
     # Stop services
-    down(service=None, prune=force)
+    down(service=None, prune=force, parallel=True)
 
     # Remove config dir
     utils.rmDir(conf.config_dir)
@@ -188,6 +195,9 @@ def up(
         None,
     ),
     restart: bool = typer.Option(False, "--restart", "-r", help="Restart services"),
+    parallel: bool = typer.Option(
+        True, "--parallel/--serial", help="Start independent services concurrently"
+    ),
 ):
     """
     Start backplane. Starts all services.
@@ -200,8 +210,15 @@ def up(
     else:
         services = [service]
 
-    for service in services:
-        s = Service(name=service, config=conf)
+    snapshot = Snapshot(conf)
+
+    # Pull missing images up front and concurrently
+    from backplane.pull import Puller, service_images
+
+    Puller(conf, service_images(conf, services, snapshot)).run()
+
+    def start(service):
+        s = Service(name=service, config=conf, snapshot=snapshot)
         if conf.verbose > 0:
             typer.secho(
                 f"up: starting {s.name}",
@@ -209,28 +226,48 @@ def up(
                 fg=typer.colors.BRIGHT_BLACK,
             )
 
-        try:
-            if restart:
-                s.stop()
-                s.remove()
+        if restart:
+            s.stop()
+            s.remove()
 
-            s.start()
-            s.echo()
-        except CannotStartService as e:
-            typer.secho(
-                f"Unable to start service {service}: {e}",
-                err=True,
-                fg=typer.colors.RED,
-            )
-            sys.exit(1)
-        except Exception as e:
+        s.start()
+        return s
+
+    orchestrate(services, start, "start", parallel=parallel)
+
+
+@app.command()
+def pull(
+    names: List[str] = typer.Argument(
+        None, help="Services or apps to pull images for (default: all)"
+    ),
+):
+    """
+    Pull the images of services and installed apps.
+    """
+    from backplane.pull import Puller, app_images, service_images
+
+    apps = conf.apps or {}
+    names = names or conf.default_services + sorted(apps)
+
+    for name in names:
+        if name not in conf.default_services and name not in apps:
             typer.secho(
-                f"Unable to start service {service}: {e}",
+                f"Unknown service or app {name}",
                 err=True,
                 fg=typer.colors.RED,
             )
             sys.exit(1)
 
+    images = service_images(
+        conf, [name for name in names if name in conf.default_services], Snapshot(conf)
+    ) + app_images(conf, [name for name in names if name in apps])
+
+    results, failures = Puller(conf, images, refresh=True).run()
+
+    if failures:
+        sys.exit(1)
+
 
 @app.command()
 def restart(
@@ -238,17 +275,23 @@ def restart(
         None,
         help="Service to restart",
     ),
+    parallel: bool = typer.Option(
+        True, "--parallel/--serial", help="Restart independent services concurrently"
+    ),
 ):
     """
     Restart service.
     """
-    up(service=service, restart=True)
+    up(service=service, restart=True, parallel=parallel)
 
 
 @app.command()
 def down(
     service: str = typer.Argument(None),
     prune: bool = typer.Option(False, "--prune", "-p", help="Remove volumes"),
+    parallel: bool = typer.Option(
+        True, "--parallel/--serial", help="Stop independent services concurrently"
+    ),
 ):
     """
     Stop backplane. Stops all services.
@@ -268,25 +311,61 @@ def down(
     else:
         services = [backplane_service]
 
-    for service in services:
-        s = Service(name=service, config=conf)
+    snapshot = Snapshot(conf)
 
-        try:
-            s.stop()
+    def stop(service):
+        s = Service(name=service, config=conf, snapshot=snapshot)
 
-            if prune:
-                s.remove(prune=True)
-            else:
-                s.remove()
+        s.stop()
 
-            s.echo()
-        except Exception as e:
+        if prune:
+            s.remove(prune=True)
+        else:
+            s.remove()
+
+        return s
+
+    orchestrate(services, stop, "stop", parallel=parallel, reverse=True)
+
+
+def orchestrate(
+    services: list, action, verb: str, parallel: bool = True, reverse: bool = False
+):
+    # Run action for all services along the dependency graph and
+    # report failures only once every service had its chance to run
+    from backplane.orchestrator import Orchestrator
+
+    try:
+        orchestrator = Orchestrator(
+            services,
+            dependencies=conf.dependencies,
+            parallelism=conf.parallelism if parallel else 1,
+            reverse=reverse,
+        )
+    except CannotResolveDependencies as e:
+        typer.secho(
+            f"Unable to {verb} services: {e}",
+            err=True,
+            fg=typer.colors.RED,
+        )
+        sys.exit(1)
+
+    results, failures = orchestrator.run(action)
+
+    for service in services:
+        if service in results:
+            results[service].echo()
+
+    for service in services:
+        if service in failures:
             typer.secho(
-                f"Unable to stop service {service}: {e}",
+                f"Unable to {verb} service {service}: {failures[service]}",
                 err=True,
                 fg=typer.colors.RED,
             )
-            sys.exit(1)
+
+    if failures:
+        sys.exit(1)
 
 
 @app.command()
@@ -296,6 +375,25 @@ def install(
     source: str = typer.Option(None, "--from", "-f"),
     destination: Path = typer.Option(None, "--to", "-t"),
     compose_file: str = typer.Option("docker-compose.yml", "--compose-file", "-c"),
+    queue: bool = typer.Option(
+        False, "--queue", "-q", help="Hand the deployment to deployd if it is running"
+    ),
+    force: bool = typer.Option(
+        False, "--force", help="Redeploy all services even if nothing changed"
+    ),
+    depth: int = typer.Option(
+        None, "--depth", help="History depth to fetch, 0 for full history"
+    ),
+    sparse: List[str] = typer.Option(
+        None, "--sparse", help="Only check out these paths (repeatable)"
+    ),
+    ref: str = typer.Option(None, "--ref", help="Commit or branch to deploy"),
+    engine: str = typer.Option(
+        None,
+        "--engine",
+        "-e",
+        help="Deploy with docker-compose (compose) or the Docker SDK (sdk)",
+    ),
 ):
     """
     Install an app into backplane.
@@ -311,6 +409,21 @@ def install(
     app_source = source if source else os.getcwd()
     app_destination = destination if destination else os.getcwd()
 
+    if queue:
+        from backplane import deployd
+
+        if deployd.running(conf):
+            deployd.enqueue(conf, app_name, app_source, ref)
+            typer.echo(f"Queued deployment of {app_name}.")
+            return
+
+        if conf.verbose > 0:
+            typer.secho(
+                "deployd is not running, deploying directly",
+                err=False,
+                fg=typer.colors.BRIGHT_BLACK,
+            )
+
     # Check if an app has been named to be taken from the app registry
     if registry_app:
         app_name = name if name else registry_app
@@ -320,6 +433,11 @@ def install(
             backplane_app = App(
                 compose_file=compose_file,
                 config=conf,
+                force=force,
+                depth=depth,
+                sparse=sparse,
+                ref=ref,
+                engine=engine,
                 destination=app_destination,
                 name=app_name,
                 registry_app=registry_app,
@@ -342,6 +460,11 @@ def install(
             backplane_app = App(
                 compose_file=compose_file,
                 config=conf,
+                force=force,
+                depth=depth,
+                sparse=sparse,
+                ref=ref,
+                engine=engine,
                 destination=app_destination,
                 name=app_name,
                 registry_app=registry_app,
@@ -360,6 +483,11 @@ def install(
             backplane_app = App(
                 compose_file=compose_file,
                 config=conf,
+                force=force,
+                depth=depth,
+                sparse=sparse,
+                ref=ref,
+                engine=engine,
                 destination=app_destination,
                 name=app_name,
                 registry_app=registry_app,
@@ -374,6 +502,45 @@ def install(
             )
 
 
+@app.command()
+def deployd(
+    workers: int = typer.Option(
+        None, "--workers", "-w", help="Maximum number of concurrent deployments"
+    ),
+):
+    """
+    Run the deployment queue fed by 'install --queue'.
+    """
+    from backplane.deployd import Deployd
+
+    try:
+        Deployd(conf, workers=workers).run()
+    except KeyboardInterrupt:
+        raise typer.Exit()
+
+
+@app.command()
+def metrics(
+    serve: bool = typer.Option(False, "--serve", help="Serve the metrics over HTTP"),
+    port: int = typer.Option(None, "--port", "-p", help="Port to serve the metrics on"),
+):
+    """
+    Show deployment and service metrics in the Prometheus format.
+    """
+    from backplane import metrics
+
+    if not serve:
+        typer.echo(metrics.render(conf), nl=False)
+        return
+
+    port = port or conf.metrics_port
+    typer.echo(f"Serving metrics on http://0.0.0.0:{port}/metrics")
+    try:
+        metrics.serve(conf, port)
+    except KeyboardInterrupt:
+        pass
+
+
 @app.command()
 def config():
     if conf.verbose > 0:
@@ -393,6 +560,9 @@ def config():
 @app.command()
 def status(
     service: str = typer.Argument(None),
+    watch: bool = typer.Option(
+        False, "--watch", "-w", help="Keep watching status changes"
+    ),
 ):
     """
     backplane status.
@@ -402,15 +572,24 @@ def status(
     else:
         services = [service]
 
+    if watch:
+        from backplane.watch import Watch
+
+        try:
+            Watch(conf, services).run()
+        except KeyboardInterrupt:
+            raise typer.Exit()
+
+    snapshot = Snapshot(conf)
+
     for service in services:
-        s = Service(service, conf)
+        s = Service(service, conf, snapshot=snapshot)
         s.echo()
 
 
 def version_callback(value: bool):
     if value:
-        version = read_version(".", "__init__.py")
-        typer.echo(f"{version}")
+        typer.echo(f"{__version__}")
         raise typer.Exit()
 
 
@@ -509,14 +688,36 @@ def callback(
         "-c",
         help="Path to backplane.yml",
     ),
+    profile: bool = typer.Option(
+        False, "--profile", help="Print time per phase and Docker API calls when done"
+    ),
+    trace_file: Path = typer.Option(
+        None,
+        "--trace-file",
+        help="Write timing spans to a file, as Chrome trace if it ends with .json",
+    ),
 ):
 
-    # Update config
+    global conf
+
+    trace.mark("startup")
+    command_span = trace.span(f"command.{ctx.invoked_subcommand}")
+
+    def on_close():
+        command_span.end()
+        if profile:
+            trace.report()
+        if profile or conf.verbose:
+            docker_client.report()
+        if trace_file:
+            trace.write(trace_file)
+
+    ctx.call_on_close(on_close)
+
+    # Update config; the default path has already been loaded on import
     try:
-        if config_path:
-            new_config = Config(config_path)
-        else:
-            new_config = Config()
+        if config_path and Path(config_path) != Path(conf.config_path):
+            conf = Config(config_path)
     except ConfigNotFound as e:
         typer.secho(
             f"Failed to load config: {e}",
@@ -524,19 +725,20 @@ def callback(
             fg=typer.colors.RED,
         )
         sys.exit(1)
-    config = new_config
 
     # Check pre-reqs
     checkPrerequisites(ctx)
 
     conf.verbose = verbose
 
+    # Size the shared Docker connection pool for our parallelism
+    docker_client.configure(parallelism=conf.parallelism)
+
     # LOAD CONFIG HERE
     # backplane_config = anyconfig.load(config_file)
 
-    version = read_version(".", "__init__.py")
     if conf.verbose > 0:
-        typer.secho(f"Version: {version}", err=False, fg=typer.colors.BRIGHT_BLACK)
+        typer.secho(f"Version: {__version__}", err=False, fg=typer.colors.BRIGHT_BLACK)
         typer.secho(
             f"Context: {conf.active_context}",
             err=False,
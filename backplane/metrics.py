@@ -0,0 +1,161 @@
+import json
+import threading
+from pathlib import Path
+from .config import Config
+from . import utils
+
+# Seconds; deployments and service starts range from sub-second to minutes
+BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+DESCRIPTIONS = {
+    "backplane_deploys_total": ("counter", "App deployments by result"),
+    "backplane_deploy_duration_seconds": ("histogram", "Duration of app deployments"),
+    "backplane_deploy_queue_seconds": (
+        "histogram",
+        "Time pushed deployments waited in the queue",
+    ),
+    "backplane_service_start_seconds": (
+        "histogram",
+        "Time until a core service was ready after starting it",
+    ),
+    "backplane_service_stop_seconds": ("histogram", "Duration of core service stops"),
+}
+
+
+def store_path(config: Config):
+    return Path(config.config_dir) / "metrics.json"
+
+
+def _key(name: str, labels: dict):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _update(config: Config, update):
+    """
+    Apply update to the stored metrics under a lock. Deployments run in
+    separate processes, so the store lives on disk next to the queue.
+    Metrics are best effort and never fail the caller.
+    """
+    path = store_path(config)
+
+    try:
+        with utils.fileLock(f"{path}.lock"):
+            try:
+                with open(path) as reader:
+                    metrics = json.load(reader)
+            except (OSError, ValueError):
+                metrics = {}
+
+            update(metrics)
+            utils.atomicWrite(path, json.dumps(metrics).encode())
+    except OSError:
+        pass
+
+
+def inc(config: Config, name: str, value: float = 1, **labels):
+    def update(metrics):
+        key = _key(name, labels)
+        metrics[key] = metrics.get(key, 0) + value
+
+    _update(config, update)
+
+
+def observe(config: Config, name: str, value: float, **labels):
+    def update(metrics):
+        key = _key(name, labels)
+        histogram = metrics.get(key) or {
+            "buckets": [0] * len(BUCKETS),
+            "sum": 0,
+            "count": 0,
+        }
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        metrics[key] = histogram
+
+    _update(config, update)
+
+
+def load(config: Config):
+    try:
+        with open(store_path(config)) as reader:
+            return json.load(reader)
+    except (OSError, ValueError):
+        return {}
+
+
+def _labels(labels: list, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def render(config: Config):
+    """
+    Metrics in the Prometheus text exposition format.
+    """
+    series = {}
+    for key, value in load(config).items():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(series):
+        kind, description = DESCRIPTIONS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        for labels, value in series[name]:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+
+            for bound, count in zip(BUCKETS, value["buckets"]):
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {value["count"]}')
+            lines.append(f"{name}_sum{_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def serve(config: Config, port: int = None, background: bool = False):
+    """
+    Serve /metrics over HTTP. With background=True the server runs in a
+    daemon thread and is returned.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            body = render(config).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port or config.metrics_port), Handler)
+
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .errors import CannotResolveDependencies, DependencyFailed
+
+
+class Orchestrator:
+    """
+    Runs an action for a set of services concurrently while respecting
+    the dependency graph between them.
+
+    Dependencies on services outside of the given set are ignored. With
+    reverse=True dependents run before their dependencies (e.g. for "down").
+    """
+
+    def __init__(
+        self,
+        services: list,
+        dependencies: dict = None,
+        parallelism: int = 4,
+        reverse: bool = False,
+    ):
+        self.services = list(services)
+        self.parallelism = max(1, int(parallelism))
+        self.graph = self._graph(dependencies or {}, reverse)
+
+    def _graph(self, dependencies: dict, reverse: bool):
+        graph = {service: set() for service in self.services}
+
+        for service in self.services:
+            for dependency in dependencies.get(service, None) or []:
+                if dependency not in graph or dependency == service:
+                    continue
+                if reverse:
+                    graph[dependency].add(service)
+                else:
+                    graph[service].add(dependency)
+
+        # Detect cycles before anything gets started
+        resolved = set()
+        remaining = dict(graph)
+        while remaining:
+            ready = [s for s, deps in remaining.items() if deps <= resolved]
+            if not ready:
+                raise CannotResolveDependencies(
+                    f"dependency cycle between services {', '.join(sorted(remaining))}"
+                )
+            for service in ready:
+                resolved.add(service)
+                remaining.pop(service)
+
+        return graph
+
+    def run(self, action, on_done=None):
+        """
+        Call action(service) for every service. Returns a tuple of
+        (results, failures), both keyed by service name. A failing service
+        only skips its own dependents, siblings keep running.
+        """
+        results = {}
+        failures = {}
+        pending = {service: set(deps) for service, deps in self.graph.items()}
+        finished = set()
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+            running = {}
+
+            while pending or running:
+                for service in self.services:
+                    if service not in pending or not pending[service] <= finished:
+                        continue
+
+                    deps = pending.pop(service)
+                    failed = sorted(deps & set(failures))
+                    if failed:
+                        failures[service] = DependencyFailed(
+                            f"skipped {service}: dependency {', '.join(failed)} failed"
+                        )
+                        finished.add(service)
+                        if on_done:
+                            on_done(service, None, failures[service])
+                        continue
+
+                    running[executor.submit(action, service)] = service
+
+                if not running:
+                    # Skipped services may have unblocked others
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    service = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        failures[service] = error
+                    else:
+                        results[service] = future.result()
+                    finished.add(service)
+                    if on_done:
+                        on_done(service, results.get(service), error)
+
+        return results, failures
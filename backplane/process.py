@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import os
+import typer
+
+# Upper bound for a single read and for an unterminated line
+DEFAULT_LIMIT = 64 * 1024
+
+
+async def read_lines(stream: asyncio.StreamReader, limit: int = DEFAULT_LIMIT):
+    """
+    Yield lines from stream without ever buffering more than limit bytes.
+    Overlong lines are split up instead of blocking the pipe.
+    """
+    pending = b""
+
+    while True:
+        chunk = await stream.read(limit)
+        if not chunk:
+            break
+
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+
+        if len(pending) >= limit:
+            yield pending
+            pending = b""
+
+    if pending:
+        yield pending
+
+
+class Process:
+    """
+    Runs a command and streams its stdout and stderr as they are written,
+    optionally with timestamps and a copy of everything in a log file.
+    """
+
+    def __init__(
+        self,
+        command: list,
+        log_path: str = None,
+        timestamps: bool = False,
+        limit: int = DEFAULT_LIMIT,
+        env: dict = None,
+    ):
+        self.command = [str(part) for part in command]
+        self.log_path = log_path
+        self.timestamps = timestamps
+        self.limit = limit
+        self.env = env
+        self.log = None
+
+    def emit(self, line: bytes, err: bool = False):
+        now = datetime.datetime.now()
+        text = line.decode(errors="replace").rstrip("\r").rsplit("\r", 1)[-1]
+
+        if self.log:
+            stream = "stderr" if err else "stdout"
+            self.log.write(f"{now.isoformat()} {stream} {text}\n")
+
+        if self.timestamps:
+            text = f"{now.strftime('%H:%M:%S')} {text}"
+
+        typer.echo(text, err=err)
+
+    async def pump(self, stream: asyncio.StreamReader, err: bool = False):
+        async for line in read_lines(stream, self.limit):
+            self.emit(line, err)
+
+    async def run(self):
+        if self.log_path:
+            os.makedirs(os.path.dirname(str(self.log_path)), exist_ok=True)
+            self.log = open(self.log_path, "a", buffering=1)
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=self.env,
+            )
+
+            await asyncio.gather(
+                self.pump(process.stdout),
+                self.pump(process.stderr, err=True),
+            )
+            return await process.wait()
+        finally:
+            if self.log:
+                self.log.close()
+                self.log = None
+
+
+def run(command: list, **kwargs):
+    # Blocking helper returning the exit code of command
+    return asyncio.run(Process(command, **kwargs).run())
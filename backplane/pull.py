@@ -0,0 +1,228 @@
+import os
+import sys
+import threading
+import time
+import typer
+from .config import Config
+from .docker_client import get_client
+from .orchestrator import Orchestrator
+from .errors import CannotPullImage
+from . import compose
+
+LAYER_STATUSES = (
+    "Pulling fs layer",
+    "Waiting",
+    "Downloading",
+    "Verifying Checksum",
+    "Download complete",
+    "Extracting",
+    "Pull complete",
+    "Already exists",
+)
+# Layer states after which nothing is left to download
+LAYER_DONE = ("Download complete", "Extracting", "Pull complete", "Already exists")
+
+
+def split_reference(reference: str):
+    # -> (repository, tag, digest)
+    repository, _, digest = reference.partition("@")
+    name = repository.rsplit("/", 1)[-1]
+    tag = None
+    if ":" in name:
+        repository, tag = repository.rsplit(":", 1)
+
+    return repository, tag, digest or None
+
+
+def mirror_reference(reference: str, mirror: str):
+    """
+    The reference of a Docker Hub image on a pull-through registry mirror,
+    or None if the image is hosted elsewhere.
+    """
+    repository, tag, digest = split_reference(reference)
+    first = repository.split("/")[0]
+
+    if digest or ("/" in repository and ("." in first or ":" in first)):
+        return None
+    if first == "localhost":
+        return None
+    if "/" not in repository:
+        repository = f"library/{repository}"
+
+    return f"{mirror.rstrip('/')}/{repository}:{tag or 'latest'}"
+
+
+def service_images(config: Config, services: list, snapshot=None):
+    from .service import Service
+
+    return [
+        Service(name=service, config=config, snapshot=snapshot).attrs["image"]
+        for service in services
+    ]
+
+
+def compose_images(app_compose, services: list = None):
+    # Images of services that aren't built; interpolated references
+    # are left to docker-compose
+    return [
+        service.image
+        for name, service in app_compose.services.items()
+        if (services is None or name in services)
+        and service.image
+        and not service.build
+        and "$" not in service.image
+    ]
+
+
+def app_images(config: Config, apps: list):
+    images = []
+    for app in apps:
+        destination = (config.apps.get(app) or {}).get("destination")
+        compose_file = os.path.join(str(destination), "docker-compose.yml")
+        if destination and os.path.exists(compose_file):
+            images += compose_images(compose.load(compose_file))
+
+    return images
+
+
+class Puller:
+    """
+    Pulls images concurrently and shows the progress of all downloads as
+    one line. Images that are already present are skipped; with
+    refresh=True they are compared with the registry by digest instead.
+    Docker Hub images are pulled through registry_mirror if configured.
+    """
+
+    def __init__(self, config: Config, images: list, refresh: bool = False):
+        self.config = config
+        self.images = sorted(set(image for image in images if image))
+        self.refresh = refresh
+        self.mirror = config.registry_mirror
+        self.layers = {}
+        self.lock = threading.Lock()
+        self.interactive = sys.stdout.isatty()
+        self.drawn = 0
+
+    def present(self, image: str):
+        from docker.errors import ImageNotFound
+
+        docker_client = get_client()
+        try:
+            local = docker_client.images.get(image)
+        except ImageNotFound:
+            return False
+
+        if not self.refresh or split_reference(image)[2]:
+            return True
+
+        try:
+            digest = docker_client.images.get_registry_data(image).id
+        except Exception:
+            # Registry not reachable, keep what we have
+            return True
+
+        return any(
+            repo_digest.endswith(f"@{digest}")
+            for repo_digest in local.attrs.get("RepoDigests") or []
+        )
+
+    def progress(self, event: dict):
+        layer = event.get("id")
+        status = event.get("status") or ""
+        if not layer or status not in LAYER_STATUSES:
+            return
+
+        with self.lock:
+            current, total = self.layers.get(layer, (0, 0))
+            detail = event.get("progressDetail") or {}
+
+            if status == "Downloading" and detail.get("total"):
+                current, total = detail.get("current", 0), detail["total"]
+            elif status in LAYER_DONE:
+                current = total = max(total, 1)
+
+            self.layers[layer] = (current, total)
+
+        self.draw()
+
+    def draw(self, done: bool = False):
+        if not self.interactive:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            if not done and now - self.drawn < 0.1:
+                return
+            self.drawn = now
+
+            layers = list(self.layers.values())
+            finished = len([1 for current, total in layers if total and current >= total])
+            current = sum(current for current, total in layers) / 1e6
+            total = sum(total for current, total in layers) / 1e6
+
+        typer.echo(
+            f"\r\x1b[2KPulling {len(self.images)} image(s): "
+            f"{finished}/{len(layers)} layers, {current:.1f}/{total:.1f} MB",
+            nl=done,
+        )
+
+    def stream(self, reference: str):
+        repository, tag, digest = split_reference(reference)
+        api = get_client().api
+
+        for event in api.pull(
+            repository, tag=digest or tag or "latest", stream=True, decode=True
+        ):
+            if event.get("error"):
+                raise CannotPullImage(event["error"])
+            self.progress(event)
+
+    def pull(self, image: str):
+        if self.present(image):
+            return "present"
+
+        mirrored = mirror_reference(image, self.mirror) if self.mirror else None
+        if mirrored:
+            try:
+                self.stream(mirrored)
+
+                api = get_client().api
+                repository, tag, _ = split_reference(image)
+                api.tag(mirrored, repository, tag or "latest")
+                api.remove_image(mirrored)
+                return "pulled from mirror"
+            except (Exception, CannotPullImage) as e:
+                if self.config.verbose > 0:
+                    typer.secho(
+                        f"Unable to pull {image} from {self.mirror}: {e}",
+                        err=False,
+                        fg=typer.colors.BRIGHT_BLACK,
+                    )
+
+        try:
+            self.stream(image)
+        except CannotPullImage:
+            raise
+        except Exception as e:
+            raise CannotPullImage(e)
+
+        return "pulled"
+
+    def run(self):
+        orchestrator = Orchestrator(self.images, parallelism=self.config.parallelism)
+        results, failures = orchestrator.run(self.pull)
+
+        if self.layers:
+            self.draw(done=True)
+
+        for image in self.images:
+            if image in results and results[image] != "present":
+                typer.echo(f"{image} {results[image]}")
+            if image in failures:
+                typer.secho(
+                    f"Unable to pull {image}: {failures[image]}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+
+        return results, failures
@@ -0,0 +1,241 @@
+import abc
+import os
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Container events that change State.Status
+STATE_EVENTS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+    "destroy": "removed",
+}
+
+
+class EventsUnavailable(Exception):
+    """Raised when the Docker events stream can't be used"""
+
+    pass
+
+
+def current_status(container):
+    from docker.errors import NotFound
+
+    try:
+        container.reload()
+    except NotFound:
+        return "removed"
+
+    return container.status
+
+
+def wait_for_status(container, status: str = "running", timeout: float = 90):
+    """
+    Wait until container reaches status. Subscribes to the Docker events
+    stream and only falls back to polling with exponential backoff if
+    events are unavailable. Returns True if status was reached in time.
+    """
+    deadline = time.time() + timeout
+
+    try:
+        return _wait_for_events(container, status, deadline)
+    except EventsUnavailable:
+        return _wait_for_poll(container, status, deadline)
+
+
+def _wait_for_events(container, status: str, deadline: float):
+    try:
+        events = container.client.events(
+            decode=True,
+            until=int(deadline) + 1,
+            filters={"type": "container", "container": container.id},
+        )
+    except Exception as e:
+        raise EventsUnavailable(e)
+
+    try:
+        # Check after subscribing so we can't miss a transition in between
+        if current_status(container) == status:
+            return True
+
+        for event in events:
+            action = event.get("Action") or event.get("status") or ""
+
+            if action in STATE_EVENTS or action.startswith("health_status"):
+                if current_status(container) == status:
+                    return True
+
+            if time.time() >= deadline:
+                return False
+    except Exception as e:
+        raise EventsUnavailable(e)
+    finally:
+        events.close()
+
+    # The daemon closed the stream early
+    if time.time() < deadline:
+        raise EventsUnavailable("events stream closed")
+
+    return current_status(container) == status
+
+
+def _wait_for_poll(
+    container, status: str, deadline: float, interval: float = 0.05, max_interval=2.0
+):
+    while True:
+        if current_status(container) == status:
+            return True
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def probe_host():
+    # Published ports are reachable on the Docker host
+    docker_host = urlparse(os.getenv("DOCKER_HOST", ""))
+    if docker_host.scheme in ("tcp", "http", "https", "ssh") and docker_host.hostname:
+        return docker_host.hostname
+
+    return "127.0.0.1"
+
+
+class Probe(abc.ABC):
+    """
+    Checks if a service actually serves requests, beyond its container
+    running.
+    """
+
+    @abc.abstractmethod
+    def ready(self):
+        pass
+
+
+class HttpProbe(Probe):
+    # Ready once url answers with a status below 400. Redirects aren't
+    # followed, answering with one is enough
+    def __init__(self, url: str, timeout: float = 1.0):
+        self.url = url
+        self.timeout = timeout
+
+    def ready(self):
+        import urllib.error
+        import urllib.request
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        try:
+            response = urllib.request.build_opener(NoRedirect).open(
+                self.url, timeout=self.timeout
+            )
+            response.close()
+            return response.status < 400
+        except urllib.error.HTTPError as e:
+            return e.code < 400
+        except (OSError, ValueError):
+            return False
+
+    def __str__(self):
+        return f"GET {self.url}"
+
+
+class TcpProbe(Probe):
+    # Ready once port accepts connections
+    def __init__(self, host: str, port: int, timeout: float = 1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def ready(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout):
+                return True
+        except OSError:
+            return False
+
+    def __str__(self):
+        return f"tcp://{self.host}:{self.port}"
+
+
+class HealthcheckProbe(Probe):
+    # Ready once Docker reports the container healthy, or running if
+    # the image has no healthcheck. One-shot services (migrations, init
+    # jobs) are done once they exited with 0
+    def __init__(self, container):
+        self.container = container
+
+    def ready(self):
+        status = current_status(self.container)
+        if status == "exited":
+            return (self.container.attrs.get("State") or {}).get("ExitCode") == 0
+        if status != "running":
+            return False
+
+        health = (self.container.attrs.get("State") or {}).get("Health")
+        return not health or health.get("Status") == "healthy"
+
+    def __str__(self):
+        return f"healthcheck of {self.container.name}"
+
+
+def wait_for_probe(
+    probe: Probe,
+    timeout: float = 90,
+    interval: float = 0.05,
+    max_interval: float = 1.0,
+    jitter: float = 0.2,
+):
+    """
+    Poll probe with backoff until it passes or timeout expires. Intervals
+    are jittered so concurrent probes don't hit the daemon in lockstep.
+    Returns True if the probe passed in time.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        if probe.ready():
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        time.sleep(min(interval * random.uniform(1 - jitter, 1 + jitter), remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def wait_for_probes(
+    probes: dict, timeout: float = 90, started: float = None, deadline: float = None
+):
+    """
+    Run probes concurrently until deadline (default: timeout seconds after
+    started, both from time.monotonic()). Returns the seconds since started
+    (default: now) until each probe passed, or None for probes that didn't
+    pass in time.
+    """
+    started = time.monotonic() if started is None else started
+    deadline = started + timeout if deadline is None else deadline
+
+    def run(probe):
+        if wait_for_probe(probe, max(0, deadline - time.monotonic())):
+            return time.monotonic() - started
+        return None
+
+    if not probes:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+        futures = {name: executor.submit(run, probe) for name, probe in probes.items()}
+        return {name: future.result() for name, future in futures.items()}
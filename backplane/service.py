@@ -1,4 +1,3 @@
-from .config import Config
 from .errors import (
     ConfigNotFound,
     ServiceNotFound,
@@ -6,17 +5,17 @@ from .errors import (
     CannotStopService,
     CannotRemoveService,
 )
-import docker
-import time
+from .docker_client import get_client
 import typer
 import os
-from read_version import read_version
+import time
+from . import __version__
+from . import readiness
+from . import metrics, trace, traefik
 
 
 class Service:
-    config = Config()
-
-    def __init__(self, name=None, config=None):
+    def __init__(self, name=None, config=None, snapshot=None):
         self.config = config
         self.name = name
 
@@ -25,42 +24,21 @@ class Service:
 
         self.container = None
         self.options = None
+        self.probe = None
+        self.ready_in = None
 
         self.populateConfig()
 
-        self._status()
+        if snapshot:
+            self.container = snapshot.get(self.name)
+        else:
+            self._status()
 
     def populateConfig(self):
         if self.name == "traefik":
             self.attrs = {
                 "image": "traefik:v2.3",
-                "command": [
-                    "--global.checkNewVersion=false",
-                    "--global.sendAnonymousUsage=false",
-                    "--entryPoints.http.address=:80",
-                    "--entryPoints.http.http.middlewares=compress@docker",
-                    # "--entryPoints.https.address=:443",
-                    "--api=true",
-                    "--api.insecure=true",
-                    "--api.dashboard=true",
-                    "--ping=true",
-                    "--serversTransport.insecureSkipVerify=true",
-                    "--log=true",
-                    "--log.level=DEBUG",
-                    "--accessLog=true",
-                    "--accessLog.bufferingSize=100",
-                    "--accessLog.filters.statusCodes=400-499",
-                    "--providers.docker=true",
-                    "--providers.docker.endpoint=unix:///var/run/docker.sock",
-                    '--providers.docker.defaultrule=Host(`{{ index .Labels "com.docker.compose.service" }}.'
-                    # "--providers.docker.defaultrule=Host(`{{ normalize .Container.Name }}."
-                    + self.config.domain + "`)",
-                    "--providers.docker.exposedByDefault=true",
-                    "--providers.docker.constraints=Label(`backplane.enabled`,`true`)",
-                    "--providers.docker.network=backplane",
-                    "--providers.file.directory=/etc/traefik",
-                    "--providers.file.watch=true",
-                ],
+                "command": traefik.static_arguments(self.config),
                 "auto_remove": False,
                 "detach": True,
                 "hostname": "traefik",
@@ -68,11 +46,7 @@ class Service:
                     "backplane.enabled": "true",
                     "backplane.service": "traefik",
                     "backplane.url": self.url,
-                    "traefik.http.routers.traefik.rule": "Host(`" + self.url + "`)",
-                    "traefik.http.middlewares.compress.compress": "true",
-                    "traefik.http.middlewares.auth.basicauth.users": f"{self.config.user}:{self.config.password_hash}",
-                    "traefik.http.middlewares.auth.basicauth.realm": "backplane",
-                    "traefik.http.routers.traefik.service": "api@internal",
+                    **traefik.labels(self.config),
                 },
                 "name": "traefik",
                 "network": "backplane",
@@ -80,6 +54,10 @@ class Service:
                 "restart_policy": {"Name": "unless-stopped"},
                 "volumes": {
                     "traefik-data": {"bind": "/letsencrypt", "mode": "rw"},
+                    str(traefik.config_dir(self.config)): {
+                        "bind": "/etc/traefik",
+                        "mode": "ro",
+                    },
                     "/var/run/docker.sock": {
                         "bind": "/var/run/docker.sock",
                         "mode": "ro",
@@ -88,71 +66,10 @@ class Service:
             }
             self.options = {
                 "https": {
-                    "command": [
-                        "--global.checkNewVersion=false",
-                        "--global.sendAnonymousUsage=false",
-                        "--entryPoints.http.address=:80",
-                        "--entryPoints.http.http.redirections.entryPoint.to=https",
-                        "--entryPoints.http.http.redirections.entryPoint.scheme=https",
-                        "--entryPoints.http.http.middlewares=compress@docker",
-                        "--entryPoints.https.address=:443",
-                        "--entryPoints.https.http.middlewares=compress@docker,secured@docker",
-                        "--entryPoints.https.http.tls.certResolver=letsencrypt",
-                        "--api=true",
-                        "--api.insecure=true",
-                        "--api.dashboard=true",
-                        "--ping=true",
-                        "--ping.entrypoint=http",
-                        "--serversTransport.insecureSkipVerify=true",
-                        "--log=true",
-                        "--log.level=DEBUG",
-                        "--accessLog=true",
-                        "--accessLog.bufferingSize=100",
-                        "--accessLog.filters.statusCodes=400-499",
-                        "--providers.docker=true",
-                        "--providers.docker.endpoint=unix:///var/run/docker.sock",
-                        '--providers.docker.defaultrule=Host(`{{ index .Labels "com.docker.compose.service" }}.'
-                        + self.config.domain
-                        + "`)",
-                        "--providers.docker.exposedByDefault=true",
-                        "--providers.docker.constraints=Label(`backplane.enabled`,`true`)",
-                        "--providers.docker.network=backplane",
-                        "--providers.file.directory=/etc/traefik",
-                        "--providers.file.watch=true",
-                        f"--certificatesresolvers.letsencrypt.acme.email={self.config.mail}",
-                        "--certificatesresolvers.letsencrypt.acme.storage=/letsencrypt/acme.json",
-                        "--certificatesresolvers.letsencrypt.acme.httpchallenge.entrypoint=http",
-                    ],
                     "ports": {"80/tcp": 80, "443/tcp": 443},
-                    "labels": {
-                        "backplane.enabled": "true",
-                        "traefik.http.routers.traefik.rule": "Host(`" + self.url + "`)",
-                        "traefik.http.middlewares.compress.compress": "true",
-                        "traefik.http.routers.traefik.service": "api@internal",
-                        "traefik.http.routers.traefik.middlewares": "auth@docker",
-                        "traefik.http.middlewares.secured.chain.middlewares": "default-headers",
-                        "traefik.http.middlewares.https-redirect.redirectScheme.scheme": "https",
-                        "traefik.http.middlewares.https-redirect.redirectScheme.permanent": "true",
-                        # "traefik.http.middlewares.default-whitelist.ipwhitelist.sourceRange": "10.0.0.0/8,192.168.0.0/16,127.0.0.1/32,172.0.0.0/8",
-                        "traefik.http.middlewares.auth.basicauth.users": f"{self.config.user}:{self.config.password_hash}",
-                        "traefik.http.middlewares.auth.basicauth.realm": "backplane",
-                        "traefik.http.middlewares.default-headers.headers.frameDeny": "true",
-                        "traefik.http.middlewares.default-headers.headers.sslRedirect": "true",
-                        "traefik.http.middlewares.default-headers.headers.browserXssFilter": "true",
-                        "traefik.http.middlewares.default-headers.headers.contentTypeNosniff": "true",
-                        "traefik.http.middlewares.default-headers.headers.forceSTSHeader": "false",
-                        "traefik.http.middlewares.default-headers.headers.stsIncludeSubdomains": "false",
-                        "traefik.http.middlewares.default-headers.headers.stsPreload": "false",
-                        "traefik.http.middlewares.default-headers.headers.sslProxyHeaders.X-FORWARDED-PROTO": "https",
-                        "traefik.http.routers.traefik-secured.service": "api@internal",
-                        "traefik.http.routers.traefik-secured.tls": "true",
-                        "traefik.http.routers.traefik-secured.rule": "Host(`"
-                        + self.url
-                        + "`)",
-                        "traefik.http.routers.traefik-secured.middlewares": "auth@docker",
-                    },
                 }
             }
+            self.probe = readiness.HttpProbe(f"http://{readiness.probe_host()}:80/ping")
         elif self.name == "portainer":
             self.attrs = {
                 "image": "portainer/portainer-ce:2.0.0",
@@ -162,8 +79,7 @@ class Service:
                 "hostname": "portainer",
                 "labels": {
                     "backplane.enabled": "true",
-                    "traefik.http.routers.portainer.rule": "Host(`" + self.url + "`)",
-                    "traefik.http.services.portainer.loadbalancer.server.port": "9000",
+                    "traefik.enable": "false",
                 },
                 "name": "portainer",
                 "ports": {"8000/tcp": 8000},
@@ -177,29 +93,24 @@ class Service:
                     },
                 },
             }
-
-            self.options = {
-                "https": {
-                    "labels": {
-                        "backplane.enabled": "true",
-                        "traefik.http.routers.portainer.rule": "Host(`" + self.url + "`)",
-                        "traefik.http.services.portainer.loadbalancer.server.port": "9000",
-                        "traefik.http.routers.portainer-secured.tls": "true",
-                        "traefik.http.routers.portainer-secured.rule": "Host(`"
-                        + self.url
-                        + "`)",
-                    },
-                }
-            }
+            self.probe = readiness.TcpProbe(readiness.probe_host(), 8000)
 
         elif self.name == "backplane":
             self.attrs = {
-                "image": f"wearep3r/backplane:{read_version('.', '__init__.py')}",
+                "image": f"wearep3r/backplane:{__version__}",
                 "auto_remove": False,
                 "detach": True,
                 "command": "ssh",
                 "hostname": "backplane",
-                "labels": {},
+                "labels": {
+                    # deployd's metrics endpoint, see metrics.serve()
+                    "backplane.enabled": "true",
+                    "traefik.http.routers.backplane.rule": "Host(`" + self.url + "`)",
+                    "traefik.http.routers.backplane.middlewares": "auth@file",
+                    "traefik.http.services.backplane.loadbalancer.server.port": str(
+                        self.config.metrics_port
+                    ),
+                },
                 "name": "backplane",
                 "network": "backplane",
                 "ports": {"2222/tcp": 2222},
@@ -227,6 +138,7 @@ class Service:
                     },
                 },
             }
+            self.probe = readiness.TcpProbe(readiness.probe_host(), 2222)
 
         else:
             raise ServiceNotFound(f"service {self.name} does not exist")
@@ -239,7 +151,7 @@ class Service:
                         self.attrs[key] = self.options["https"][key]
 
     def _status(self):
-        docker_client = docker.from_env()
+        docker_client = get_client()
 
         try:
             containers = docker_client.containers.list(
@@ -266,7 +178,7 @@ class Service:
         # message_prefix = typer.style(" ∟ ", fg=typer.colors.RED)
 
         if self.container:
-            if self.container.attrs["State"]["Status"] == "running":
+            if self.container.status == "running":
                 message_status = typer.style("running", fg=typer.colors.GREEN, bold=True)
 
                 if self.name != "backplane":
@@ -274,29 +186,34 @@ class Service:
                     message_info = typer.style(f" ({url_prefix}{self.url})")
                 else:
                     message_info = ""
-            elif self.container.attrs["State"]["Status"] == "starting":
+
+                if self.ready_in is not None:
+                    message_info += typer.style(
+                        f" ready in {self.ready_in:.1f}s", fg=typer.colors.BRIGHT_BLACK
+                    )
+            elif self.container.status == "starting":
                 message_status = typer.style(
                     "starting", fg=typer.colors.WHITE, bg=typer.colors.BLUE
                 )
-            elif self.container.attrs["State"]["Status"] == "exited":
+            elif self.container.status == "exited":
                 message_status = typer.style(
                     "exited", fg=typer.colors.WHITE, bg=typer.colors.RED
                 )
                 message_info = typer.style(
                     f" (HINT: run 'backplane up' to start {self.name})"
                 )
-            elif self.container.attrs["State"]["Status"] == "dead":
+            elif self.container.status == "dead":
                 message_status = typer.style(
                     "dead", fg=typer.colors.WHITE, bg=typer.colors.BRIGHT_RED
                 )
-            elif self.container.attrs["State"]["Status"] == "created":
+            elif self.container.status == "created":
                 message_status = typer.style(
                     "created", fg=typer.colors.WHITE, bg=typer.colors.BRIGHT_BLACK
                 )
                 message_info = typer.style(
                     f" (HINT: run 'backplane up' to start {self.name})"
                 )
-            elif self.container.attrs["State"]["Status"] == "paused":
+            elif self.container.status == "paused":
                 message_status = typer.style(
                     "paused", fg=typer.colors.WHITE, bg=typer.colors.MAGENTA
                 )
@@ -318,13 +235,26 @@ class Service:
 
         typer.echo("".join(output), nl=nl)
 
+    @trace.traced("service.start")
     def start(self):
-        docker_client = docker.from_env()
+        docker_client = get_client()
+
+        # Routing changes are hot-reloaded by a running traefik
+        if self.name == "traefik":
+            traefik.write(self.config)
+
+            # Created before the file provider, it can't see the dynamic config
+            if self.container and not self.mounted("/etc/traefik"):
+                typer.echo("Recreating traefik to mount its dynamic configuration")
+                self.remove()
+
+        started = time.monotonic()
+
         if not self.container:
             try:
                 self.container = docker_client.containers.run(**self.attrs)
 
-                self.wait()
+                running = self.wait()
 
             except Exception as e:
                 raise CannotStartService(
@@ -332,12 +262,36 @@ class Service:
                 )
 
         else:
-            if self.container.attrs["State"]["Status"] != "running":
+            if self.container.status != "running":
                 self.container.start()
-                self.wait()
+                running = self.wait()
+            else:
+                return
+
+        if not running:
+            raise CannotStartService(
+                f"service {self.name} not running after {self.start_timeout}s"
+            )
+
+        self.ready_in = time.monotonic() - started
+        metrics.observe(
+            self.config,
+            "backplane_service_start_seconds",
+            self.ready_in,
+            service=self.name,
+        )
+
+    def mounted(self, destination: str):
+        # Containers listed without mounts are assumed to be up to date
+        mounts = self.container.attrs.get("Mounts")
+        if mounts is None:
+            return True
+
+        return any(mount.get("Destination") == destination for mount in mounts)
 
     def stop(self):
         if self.container:
+            started = time.monotonic()
             try:
                 self.container.stop()
                 self.wait("exited")
@@ -346,6 +300,13 @@ class Service:
                     f"Unable to stop container for service {self.name}: {e}"
                 )
 
+            metrics.observe(
+                self.config,
+                "backplane_service_stop_seconds",
+                time.monotonic() - started,
+                service=self.name,
+            )
+
     def remove(self, prune: bool = False):
         if self.container:
             try:
@@ -355,7 +316,7 @@ class Service:
 
                 if prune:
                     # Remove volumes
-                    docker_client = docker.from_env()
+                    docker_client = get_client()
 
                     volumes = docker_client.volumes.list(filters={"name": self.name})
 
@@ -371,16 +332,35 @@ class Service:
                 )
 
     def wait(self, status: str = "running"):
-        retries = 0
-        while (
-            self.container.attrs["State"]["Status"] != status
-            and retries < self.start_timeout
-        ):
-            self.container.reload()
-            time.sleep(1)
-            retries += 1
-            typer.echo(
-                f"Waiting for service {self.name} to become {status} ({self.start_timeout-retries})\r",
-                nl=False,
+        if self.config.verbose > 0:
+            typer.secho(
+                f"Waiting for service {self.name} to become {status}",
+                err=False,
+                fg=typer.colors.BRIGHT_BLACK,
+            )
+
+        started = time.monotonic()
+        if not readiness.wait_for_status(self.container, status, self.start_timeout):
+            return False
+
+        if status != "running" or not self.probe:
+            return True
+
+        # Running isn't ready yet, e.g. traefik still has to load its routes
+        if self.config.verbose > 0:
+            typer.secho(
+                f"Waiting for {self.probe}",
+                err=False,
+                fg=typer.colors.BRIGHT_BLACK,
             )
+
+        remaining = self.start_timeout - (time.monotonic() - started)
+        with trace.span("service.probe", service=self.name):
+            ready = readiness.wait_for_probe(self.probe, max(0, remaining))
+
+        if not ready:
+            raise CannotStartService(
+                f"service {self.name} not ready after {self.start_timeout}s ({self.probe})"
+            )
+
         return True
@@ -0,0 +1,57 @@
+from .config import Config
+from .docker_client import get_client
+from .errors import ServiceNotFound
+from .fingerprint import project_name
+
+
+class Snapshot:
+    """
+    A point-in-time view of all backplane containers (core services,
+    installed apps and anything labelled backplane.enabled), fetched with a
+    single list call and indexed by container name.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.containers = {}
+
+        self.refresh()
+
+    def refresh(self):
+        docker_client = get_client()
+
+        try:
+            # sparse=True avoids one inspect call per container
+            containers = docker_client.containers.list(all=True, sparse=True)
+        except Exception as e:
+            raise ServiceNotFound(f"Unable to list containers: {e}")
+
+        # Compose project labels carry normalized app names
+        projects = {project_name(app) for app in self.config.apps or {}}
+
+        self.containers = {}
+        for container in containers:
+            name = self.name(container)
+            if self.relevant(name, container, projects):
+                self.containers[name] = container
+
+        return self.containers
+
+    @staticmethod
+    def name(container):
+        names = container.attrs.get("Names") or [container.attrs.get("Name") or ""]
+        return names[0].strip("/")
+
+    def relevant(self, name: str, container, projects: set):
+        labels = container.attrs.get("Labels") or {}
+
+        if name in self.config.default_services:
+            return True
+
+        if labels.get("com.docker.compose.project") in projects:
+            return True
+
+        return labels.get("backplane.enabled") == "true"
+
+    def get(self, name: str):
+        return self.containers.get(name)
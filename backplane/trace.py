@@ -0,0 +1,159 @@
+import functools
+import json
+import os
+import threading
+import time
+import typer
+
+# Finished spans; bounded so long-running processes don't grow forever
+MAX_SPANS = 10000
+
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+
+# Timestamps are relative to the import of this module
+_origin = time.perf_counter()
+_origin_wall = time.time()
+
+
+class Span:
+    """
+    A timed phase. Use as a context manager or call end() explicitly.
+    Spans started while another one is active on the same thread are
+    nested below it.
+    """
+
+    __slots__ = ("name", "attributes", "start", "duration", "depth", "thread")
+
+    def __init__(self, name: str, attributes: dict = None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.duration = None
+        self.thread = threading.get_ident()
+
+        stack = _stack()
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter() - _origin
+
+    def end(self):
+        if self.duration is not None:
+            return self
+
+        self.duration = time.perf_counter() - _origin - self.start
+
+        stack = _stack()
+        if self in stack:
+            stack.remove(self)
+
+        with _lock:
+            if len(_spans) < MAX_SPANS:
+                _spans.append(self)
+
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.end()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": round(self.start * 1000, 3),
+            "duration": round((self.duration or 0) * 1000, 3),
+            "depth": self.depth,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def span(name: str, **attributes):
+    return Span(name, attributes)
+
+
+def mark(name: str, **attributes):
+    # A span from the start of the process (import of this module) until now
+    span = Span(name, attributes)
+    span.start = 0.0
+    return span.end()
+
+
+def traced(name: str = None):
+    # Decorator recording a span for every call of a function
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def spans():
+    with _lock:
+        return sorted(_spans, key=lambda s: s.start)
+
+
+def report():
+    """
+    Print the time spent per phase, nested phases indented below their
+    parents. Repeated phases are summed up.
+    """
+    finished = spans()
+    if not finished:
+        return
+
+    total = max(s.start + s.duration for s in finished)
+    phases = {}
+    for s in finished:
+        phase = phases.setdefault((s.depth, s.name), [0, 0.0])
+        phase[0] += 1
+        phase[1] += s.duration
+
+    typer.secho(f"Profile ({total * 1000:.1f} ms)", err=True, bold=True)
+    for (depth, name), (count, duration) in phases.items():
+        label = f"{'  ' * depth}{name}" + (f" (x{count})" if count > 1 else "")
+        typer.echo(
+            f"  {label:<48} {duration * 1000:>10.1f} ms {duration / total:>6.1%}",
+            err=True,
+        )
+
+
+def write(path: str):
+    """
+    Write spans to path: Chrome trace format (chrome://tracing, Perfetto)
+    if it ends with .json, JSON lines otherwise.
+    """
+    finished = spans()
+
+    with open(path, "w") as writer:
+        if str(path).endswith(".json"):
+            events = [
+                {
+                    "name": s.name,
+                    "ph": "X",
+                    "ts": round((_origin_wall + s.start) * 1e6),
+                    "dur": round(s.duration * 1e6),
+                    "pid": os.getpid(),
+                    "tid": s.thread,
+                    "args": s.attributes,
+                }
+                for s in finished
+            ]
+            json.dump({"traceEvents": events}, writer, default=str)
+        else:
+            for s in finished:
+                writer.write(json.dumps(s.to_dict(), default=str) + "\n")
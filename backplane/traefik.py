@@ -0,0 +1,179 @@
+from pathlib import Path
+from .config import Config
+from . import utils
+
+
+def config_dir(config: Config):
+    # Mounted to /etc/traefik, watched by Traefik's file provider
+    return Path(config.config_dir) / "traefik"
+
+
+def static_arguments(config: Config):
+    """
+    Command line of the traefik container. Everything that can change at
+    runtime lives in the dynamic configuration instead.
+    """
+    arguments = [
+        "--global.checkNewVersion=false",
+        "--global.sendAnonymousUsage=false",
+        "--entryPoints.http.address=:80",
+        "--entryPoints.http.http.middlewares=compress@file",
+        "--api=true",
+        "--api.insecure=true",
+        "--api.dashboard=true",
+        "--ping=true",
+        "--ping.entrypoint=http",
+        "--serversTransport.insecureSkipVerify=true",
+        "--log=true",
+        "--log.level=DEBUG",
+        "--accessLog=true",
+        "--accessLog.bufferingSize=100",
+        "--accessLog.filters.statusCodes=400-499",
+        "--providers.docker=true",
+        "--providers.docker.endpoint=unix:///var/run/docker.sock",
+        '--providers.docker.defaultrule=Host(`{{ index .Labels "com.docker.compose.service" }}.'
+        + config.domain
+        + "`)",
+        "--providers.docker.exposedByDefault=true",
+        "--providers.docker.constraints=Label(`backplane.enabled`,`true`)",
+        "--providers.docker.network=backplane",
+        "--providers.file.directory=/etc/traefik",
+        "--providers.file.watch=true",
+    ]
+
+    if config.https:
+        arguments += [
+            "--entryPoints.http.http.redirections.entryPoint.to=https",
+            "--entryPoints.http.http.redirections.entryPoint.scheme=https",
+            "--entryPoints.https.address=:443",
+            "--entryPoints.https.http.middlewares=compress@file,secured@file",
+            "--entryPoints.https.http.tls.certResolver=letsencrypt",
+            f"--certificatesresolvers.letsencrypt.acme.email={config.mail}",
+            "--certificatesresolvers.letsencrypt.acme.storage=/letsencrypt/acme.json",
+            "--certificatesresolvers.letsencrypt.acme.httpchallenge.entrypoint=http",
+        ]
+
+    return arguments
+
+
+def middlewares(config: Config):
+    middlewares = {
+        "compress": {"compress": {}},
+        "auth": {
+            "basicAuth": {
+                "users": [f"{config.user}:{config.password_hash}"],
+                "realm": "backplane",
+            }
+        },
+    }
+
+    if config.https:
+        middlewares.update(
+            {
+                "secured": {"chain": {"middlewares": ["default-headers"]}},
+                "https-redirect": {
+                    "redirectScheme": {"scheme": "https", "permanent": True}
+                },
+                "default-headers": {
+                    "headers": {
+                        "frameDeny": True,
+                        "sslRedirect": True,
+                        "browserXssFilter": True,
+                        "contentTypeNosniff": True,
+                        "forceSTSHeader": False,
+                        "stsIncludeSubdomains": False,
+                        "stsPreload": False,
+                        "sslProxyHeaders": {"X-FORWARDED-PROTO": "https"},
+                    }
+                },
+            }
+        )
+
+    return middlewares
+
+
+def dynamic_config(config: Config):
+    """
+    Portainer's routers and service and the middlewares. Apps can use the
+    middlewares as e.g. auth@file.
+    """
+    routers = {
+        "portainer": {
+            "rule": f"Host(`portainer.{config.domain}`)",
+            "service": "portainer",
+        },
+    }
+    services = {
+        "portainer": {"loadBalancer": {"servers": [{"url": "http://portainer:9000"}]}}
+    }
+
+    if config.https:
+        routers["portainer-secured"] = dict(routers["portainer"], tls={})
+
+    return {
+        "http": {
+            "middlewares": middlewares(config),
+            "routers": routers,
+            "services": services,
+        }
+    }
+
+
+def flatten(prefix: str, value):
+    # Dynamic configuration as Docker labels
+    if isinstance(value, dict):
+        labels = {}
+        for key, item in value.items():
+            labels.update(flatten(f"{prefix}.{key}", item))
+        return labels or {prefix: "true"}
+    if isinstance(value, list):
+        return {prefix: ",".join(str(item) for item in value)}
+    if isinstance(value, bool):
+        return {prefix: str(value).lower()}
+
+    return {prefix: str(value)}
+
+
+def labels(config: Config):
+    """
+    Labels of the traefik container: the dashboard's routers, and the
+    middlewares once more for services that still use e.g. auth@docker
+    from before the file provider.
+    """
+    routers = {
+        "traefik": {
+            "rule": f"Host(`traefik.{config.domain}`)",
+            "service": "api@internal",
+        },
+    }
+
+    if config.https:
+        routers["traefik"]["middlewares"] = ["auth"]
+        routers["traefik-secured"] = dict(routers["traefik"], tls={})
+
+    return {
+        "traefik.enable": "true",
+        **flatten("traefik.http.routers", routers),
+        **flatten("traefik.http.middlewares", middlewares(config)),
+    }
+
+
+def write(config: Config):
+    """
+    Write the dynamic configuration if it changed. Traefik picks it up
+    without being restarted.
+    """
+    import anyconfig
+
+    path = config_dir(config) / "backplane.yml"
+    data = anyconfig.dumps(dynamic_config(config), ac_parser="yaml").encode()
+
+    try:
+        with open(path, "rb") as reader:
+            if reader.read() == data:
+                return path
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    utils.atomicWrite(path, data)
+    return path
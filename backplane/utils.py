@@ -1,18 +1,19 @@
-import subprocess
+import fcntl
 import os
+import stat
 import sys
-import requests
 import platform
+import tempfile
 import typer
-import docker
-import anyconfig
+from .docker_client import get_client
 import json
+from contextlib import contextmanager
 
 
 def rmNetwork(network: str):
     # Remove network
     try:
-        docker_client = docker.from_env()
+        docker_client = get_client()
         docker_networks = docker_client.networks.list(names=network)
         for network in docker_networks:
             if network.name == network:
@@ -47,7 +48,7 @@ def createNetwork(network: str):
 
     try:
 
-        docker_client = docker.from_env()
+        docker_client = get_client()
 
         docker_networks = docker_client.networks.list(names=network)
 
@@ -66,7 +67,7 @@ def createNetwork(network: str):
 
     if not backplane_network_exists:
         try:
-            docker_client = docker.from_env()
+            docker_client = get_client()
             backplane_network = docker_client.networks.create(
                 name=network,
                 check_duplicate=True,
@@ -85,6 +86,8 @@ def createNetwork(network: str):
 
 
 def readConfig(config_path: str, backplane):
+    import anyconfig
+
     try:
         backplane_config = backplane
         if os.path.exists(config_path):
@@ -104,6 +107,8 @@ def readConfig(config_path: str, backplane):
 
 
 def writeConfig(config_path: str, config):
+    import anyconfig
+
     try:
         backplane_config = anyconfig.loads(json.dumps(config), ac_parser="json")
         # anyconfig.merge(backplane_config, config)
@@ -124,6 +129,47 @@ def writeConfig(config_path: str, config):
         sys.exit(1)
 
 
+def atomicWrite(path, data: bytes, mode: int = None):
+    # Write to a temporary file next to path and rename it into place,
+    # so readers either see the old or the new content
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.")
+
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+
+    try:
+        with os.fdopen(fd, "wb") as writer:
+            writer.write(data)
+            writer.flush()
+            os.fsync(writer.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def fileLock(path):
+    # Exclusive advisory lock on a separate lock file; the locked file
+    # itself gets replaced by atomicWrite()
+    with open(path, "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield lock
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
 def createDir(directory: str):
     if not os.path.exists(directory):
         try:
@@ -139,6 +185,8 @@ def createDir(directory: str):
 
 
 def rmDir(directory: str):
+    import subprocess
+
     try:
         subprocess.run(
             [
@@ -158,6 +206,8 @@ def rmDir(directory: str):
 def getDynamicDomain(environment: str = "sss"):
     domain = backplane["domain"]
     if environment == "production":
+        import requests
+
         try:
             f = requests.request("GET", "https://ifconfig.me")
             ip = f.text.replace(".", "-")
@@ -0,0 +1,184 @@
+import sys
+import time
+import typer
+from .config import Config
+from .docker_client import get_client
+from .fingerprint import project_name
+from .readiness import STATE_EVENTS
+from .snapshot import Snapshot
+
+STATUS_COLORS = {
+    "running": {"fg": typer.colors.GREEN, "bold": True},
+    "starting": {"fg": typer.colors.WHITE, "bg": typer.colors.BLUE},
+    "degraded": {"fg": typer.colors.WHITE, "bg": typer.colors.YELLOW},
+    "exited": {"fg": typer.colors.WHITE, "bg": typer.colors.RED},
+    "dead": {"fg": typer.colors.WHITE, "bg": typer.colors.BRIGHT_RED},
+    "created": {"fg": typer.colors.WHITE, "bg": typer.colors.BRIGHT_BLACK},
+    "paused": {"fg": typer.colors.WHITE, "bg": typer.colors.MAGENTA},
+    "missing": {"fg": typer.colors.WHITE, "bg": typer.colors.RED},
+}
+
+
+class Watch:
+    """
+    Live status of core services and installed apps. Keeps one in-memory
+    model that is updated from the Docker events stream and only redraws
+    the lines that changed.
+    """
+
+    def __init__(self, config: Config, services: list):
+        self.config = config
+        self.services = list(services)
+        self.apps = sorted(config.apps or {})
+        # Compose project labels carry normalized app names
+        self.projects = {project_name(app) for app in self.apps}
+        self.containers = {}
+        self.lines = []
+        self.interactive = sys.stdout.isatty()
+
+    def load(self):
+        snapshot = Snapshot(self.config)
+
+        self.containers = {}
+        for name, container in snapshot.containers.items():
+            labels = container.attrs.get("Labels") or {}
+            self.containers[container.id] = {
+                "name": name,
+                "project": labels.get("com.docker.compose.project"),
+                "status": container.status,
+            }
+
+    def update(self, event: dict):
+        """
+        Apply a container event to the model. Returns True if the event
+        was relevant.
+        """
+        action = event.get("Action") or event.get("status") or ""
+        if action not in STATE_EVENTS:
+            return False
+
+        actor = event.get("Actor") or {}
+        container_id = actor.get("ID") or event.get("id")
+        attributes = actor.get("Attributes") or {}
+        name = attributes.get("name", "")
+        project = attributes.get("com.docker.compose.project")
+
+        if name not in self.services and project not in self.projects:
+            return False
+
+        if STATE_EVENTS[action] == "removed":
+            return self.containers.pop(container_id, None) is not None
+
+        self.containers[container_id] = {
+            "name": name,
+            "project": project,
+            "status": STATE_EVENTS[action],
+        }
+        return True
+
+    def service_status(self, service: str):
+        for container in self.containers.values():
+            if container["name"] == service:
+                return container["status"]
+
+        return "missing"
+
+    def app_status(self, app: str):
+        project = project_name(app)
+        containers = [c for c in self.containers.values() if c["project"] == project]
+        running = [c for c in containers if c["status"] == "running"]
+
+        if not containers:
+            return "missing", ""
+        if len(running) == len(containers):
+            return "running", f" ({len(running)}/{len(containers)})"
+        if running:
+            return "degraded", f" ({len(running)}/{len(containers)})"
+
+        return containers[0]["status"], f" (0/{len(containers)})"
+
+    def render(self):
+        lines = []
+        url_prefix = "https://" if self.config.https else "http://"
+
+        for service in self.services:
+            status = self.service_status(service)
+            info = ""
+            if status == "running" and service != "backplane":
+                info = f" ({url_prefix}{service}.{self.config.domain})"
+            lines.append(self.line(service, status, info))
+
+        for app in self.apps:
+            status, info = self.app_status(app)
+            lines.append(self.line(app, status, info))
+
+        return lines
+
+    @staticmethod
+    def line(name: str, status: str, info: str = ""):
+        return "".join(
+            [
+                typer.style(f"{name} ", bold=True),
+                typer.style(status, **STATUS_COLORS.get(status, {})),
+                typer.style(info),
+            ]
+        )
+
+    def draw(self):
+        lines = self.render()
+
+        if not self.lines or len(lines) != len(self.lines):
+            for line in lines:
+                typer.echo(line)
+        elif self.interactive:
+            # Move up to each changed line, rewrite it and come back down
+            for index, line in enumerate(lines):
+                if line == self.lines[index]:
+                    continue
+                offset = len(lines) - index
+                typer.echo(f"\x1b[{offset}A\r\x1b[2K{line}\x1b[{offset}B\r", nl=False)
+        else:
+            for index, line in enumerate(lines):
+                if line != self.lines[index]:
+                    typer.echo(line)
+
+        self.lines = lines
+
+    def run(self):
+        docker_client = get_client()
+        retry = 1
+
+        while True:
+            try:
+                events = docker_client.events(decode=True, filters={"type": "container"})
+            except Exception as e:
+                typer.secho(
+                    f"Unable to subscribe to Docker events: {e}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+                time.sleep(retry)
+                retry = min(retry * 2, 30)
+                continue
+
+            try:
+                # Resync after (re)subscribing so no transition gets lost
+                self.load()
+                self.draw()
+                retry = 1
+
+                for event in events:
+                    if self.update(event):
+                        self.draw()
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                typer.secho(
+                    f"Lost Docker events stream: {e}",
+                    err=True,
+                    fg=typer.colors.RED,
+                )
+                time.sleep(retry)
+                retry = min(retry * 2, 30)
+            finally:
+                events.close()
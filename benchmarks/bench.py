@@ -0,0 +1,477 @@
+"""
+Benchmarks of backplane against a fake Docker daemon (see fakedocker.py).
+
+Every benchmark runs in a throwaway BACKPLANE_CONFIG_DIR with DOCKER_HOST
+pointing at the fake daemon, and reports its latency and the number of
+Docker API calls per iteration. Exits with 1 if a benchmark exceeds its
+budget of API calls:
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --services 50 --repeat 20 --json results.json
+    python benchmarks/bench.py deploy config
+
+The fake daemon doesn't run anything, so published ports of the core
+services are never reachable: their TCP/HTTP readiness probes are treated
+as passed. Container state and healthchecks come from the fake daemon,
+which starts containers --delay seconds after the request, so waiting for
+a container to run goes through its events stream.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fakedocker import FakeDocker  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, group: str, budget=None):
+    """
+    Register a benchmark. The decorated function gets the Bench and
+    returns a callable that is timed (optionally with a setup callable to
+    run before every iteration, untimed). budget(bench) is the maximum
+    number of Docker API calls per iteration.
+    """
+
+    def decorator(function):
+        BENCHMARKS[name] = (group, function, budget)
+        return function
+
+    return decorator
+
+
+class Bench:
+    def __init__(self, services: int, apps: int, latency: float, delay: float):
+        self.services = services
+        self.apps = apps
+        self.directory = Path(tempfile.mkdtemp(prefix="backplane-bench-"))
+
+        self.docker = FakeDocker(
+            self.directory / "docker.sock", latency=latency, delay=delay
+        ).start()
+
+        os.environ["DOCKER_HOST"] = self.docker.url
+        os.environ["BACKPLANE_CONFIG_DIR"] = str(self.directory / "config")
+        os.environ.setdefault("HOME", str(self.directory))
+        (self.directory / "config" / "contexts" / "default").mkdir(parents=True)
+
+        from backplane import readiness
+
+        # Published ports don't exist on the fake daemon
+        wait_for_probe = readiness.wait_for_probe
+
+        def probe(probe, *args, **kwargs):
+            if isinstance(probe, readiness.HealthcheckProbe):
+                return wait_for_probe(probe, *args, **kwargs)
+            return True
+
+        readiness.wait_for_probe = probe
+
+    def config(self, **values):
+        from backplane.config import Config
+
+        config = Config()
+        config.merge(values)
+        return config
+
+    def images(self, *images):
+        for image in images:
+            self.docker.state.add_image(image)
+
+    def reset(self):
+        # Forget containers, networks and volumes of earlier benchmarks
+        state = self.docker.state
+        with state.lock:
+            state.containers.clear()
+            state.networks.clear()
+            state.volumes.clear()
+
+    def compose_app(self, name: str, services: int):
+        """
+        An app with services services, half of them routed by traefik
+        """
+        destination = self.directory / "apps" / name
+        destination.mkdir(parents=True, exist_ok=True)
+
+        lines = ["version: '3'", "services:"]
+        for index in range(services):
+            lines += [
+                f"  service{index}:",
+                f"    image: bench/service{index}:1.0",
+                "    restart: unless-stopped",
+                "    environment:",
+                f"      - INDEX={index}",
+                "    volumes:",
+                f"      - data{index}:/data",
+                "    labels:",
+                f"      - backplane.enabled={'true' if index % 2 else 'false'}",
+                "    networks:",
+                "      - default",
+            ]
+            if index:
+                lines += ["    depends_on:", f"      - service{index - 1}"]
+        lines += ["volumes:"] + [f"  data{index}:" for index in range(services)]
+        lines += ["networks:", "  default:"]
+
+        (destination / "docker-compose.yml").write_text("\n".join(lines) + "\n")
+        self.images(*[f"bench/service{index}:1.0" for index in range(services)])
+
+        return destination
+
+    def close(self):
+        import shutil
+
+        self.docker.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+@benchmark("service_construct", "service", budget=lambda bench: 3)
+def service_construct(bench):
+    # One list call per Service without a snapshot
+    from backplane.service import Service
+
+    config = bench.config()
+    return lambda: [Service(name, config) for name in config.default_services]
+
+
+@benchmark("service_status", "service", budget=lambda bench: 1)
+def service_status(bench):
+    from backplane.service import Service
+    from backplane.snapshot import Snapshot
+
+    config = bench.config()
+
+    def status():
+        snapshot = Snapshot(config)
+        with quiet():
+            for name in config.default_services:
+                Service(name, config, snapshot=snapshot).echo()
+
+    return status
+
+
+def core(bench):
+    from backplane import __version__, main
+
+    bench.images("traefik:v2.3", "portainer/portainer-ce:2.0.0")
+    bench.images(f"wearep3r/backplane:{__version__}")
+    main.conf = bench.config()
+    return main
+
+
+# Budgets are 1 list of the containers plus the calls per core service
+# (or app service). Waiting for a container costs the events subscription,
+# 1 inspect after subscribing and 1 per state event; polling instead of
+# the events stream exceeds them once containers take a while to start
+
+
+@benchmark("up_cold", "up", budget=lambda bench: 1 + 3 * 7)
+def up_cold(bench):
+    # Per service: inspect image, create and inspect, start, wait
+    main = core(bench)
+
+    def up():
+        with quiet():
+            main.up(service=None, restart=False, parallel=True)
+
+    return up, bench.reset
+
+
+@benchmark("up_noop", "up", budget=lambda bench: 1 + 3)
+def up_noop(bench):
+    # Everything is running already, per service: inspect image
+    main = core(bench)
+    bench.reset()
+    with quiet():
+        main.up(service=None, restart=False, parallel=True)
+
+    def up():
+        with quiet():
+            main.up(service=None, restart=False, parallel=True)
+
+    return up
+
+
+@benchmark("down", "up", budget=lambda bench: 1 + 3 * 7)
+def down(bench):
+    # Per service: stop and wait, stop again and wait, remove
+    main = core(bench)
+
+    def setup():
+        bench.reset()
+        with quiet():
+            main.up(service=None, restart=False, parallel=True)
+
+    def down():
+        with quiet():
+            main.down(service=None, prune=False, parallel=True)
+
+    return down, setup
+
+
+def apps_config(bench):
+    config = bench.config()
+    config.write(
+        {
+            "apps": {
+                f"app{index}": {
+                    "destination": str(bench.directory / "apps" / f"app{index}"),
+                    "source": f"https://github.com/backplane-apps/app{index}",
+                    "params": {"index": index},
+                }
+                for index in range(bench.apps)
+            }
+        }
+    )
+    return config
+
+
+@benchmark("config_load_cached", "config")
+def config_load_cached(bench):
+    from backplane.config import Config
+
+    apps_config(bench)
+    return lambda: Config()
+
+
+@benchmark("config_load_parse", "config")
+def config_load_parse(bench):
+    from backplane.config import Config
+
+    config = apps_config(bench)
+    return lambda: Config(), lambda: config.cache_path().unlink()
+
+
+@benchmark("config_write_app", "config")
+def config_write_app(bench):
+    config = apps_config(bench)
+    counter = itertools.count()
+
+    return lambda: config.write_app(
+        "app0",
+        {"destination": "/tmp/app0", "source": "app0", "params": {"n": next(counter)}},
+    )
+
+
+@benchmark("compose_load_cold", "compose")
+def compose_load_cold(bench):
+    from backplane import compose
+
+    path = str(bench.compose_app("compose", bench.services) / "docker-compose.yml")
+    return lambda: compose.load(path), compose._cache.clear
+
+
+@benchmark("compose_load_warm", "compose")
+def compose_load_warm(bench):
+    from backplane import compose
+
+    path = str(bench.compose_app("compose", bench.services) / "docker-compose.yml")
+    compose.load(path)
+    return lambda: compose.load(path)
+
+
+def app(bench, name: str, force: bool):
+    from backplane.app import App
+
+    destination = str(bench.compose_app(name, bench.services))
+    config = bench.config()
+
+    return App(
+        name=name,
+        source=destination,
+        destination=destination,
+        config=config,
+        compose_file="docker-compose.yml",
+        force=force,
+        engine="sdk",
+    )
+
+
+@benchmark("app_urls", "compose")
+def app_urls(bench):
+    return app(bench, "urls", force=False).getAppURLs
+
+
+@benchmark("deploy", "deploy", budget=lambda bench: 2 + bench.services * 12)
+def deploy(bench):
+    # Full deployment with the sdk engine, recreating every service. Plus
+    # listing networks, per service: inspect the image 4 times, inspect the
+    # volume, stop, remove, create and inspect, start, and probe its
+    # healthcheck twice as the last ones may still be starting
+    install = app(bench, "deploy", force=True).install
+
+    def run():
+        with quiet():
+            install()
+
+    return run
+
+
+@benchmark("deploy_unchanged", "deploy", budget=lambda bench: 1 + bench.services)
+def deploy_unchanged(bench):
+    # Nothing changed since the last deployment, per service: inspect the
+    # image for the fingerprint
+    install = app(bench, "unchanged", force=False).install
+    with quiet():
+        install()
+
+    def run():
+        with quiet():
+            install()
+
+    return run
+
+
+def measure(bench, name: str, repeat: int, warmup: int):
+    from backplane import compose, docker_client
+
+    group, function, budget = BENCHMARKS[name]
+    limit = budget(bench) if budget else None
+    bench.reset()
+    compose._cache.clear()
+    docker_client.reset()
+
+    prepared = function(bench)
+    run, setup = prepared if isinstance(prepared, tuple) else (prepared, None)
+
+    timings = []
+    calls = []
+    api_seconds = []
+    exceeded = None
+    for iteration in range(warmup + repeat):
+        if setup:
+            setup()
+
+        bench.docker.reset_calls()
+        docker_client.reset_calls()
+        started = time.perf_counter()
+        try:
+            with docker_client.api_budget(limit):
+                run()
+        except AssertionError as e:
+            exceeded = str(e)
+        elapsed = time.perf_counter() - started
+
+        if iteration >= warmup:
+            timings.append(elapsed)
+            calls.append(dict(bench.docker.calls))
+            api_seconds.append(
+                sum(seconds for count, seconds in docker_client.calls().values())
+            )
+
+    total = [sum(c.values()) for c in calls]
+    endpoints = {}
+    for c in calls:
+        for endpoint, count in c.items():
+            endpoints[endpoint] = max(endpoints.get(endpoint, 0), count)
+
+    return {
+        "name": name,
+        "group": group,
+        "repeat": repeat,
+        "min_ms": min(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "api_calls": max(total),
+        "api_ms": statistics.median(api_seconds) * 1000,
+        "api_budget": limit,
+        "api_budget_exceeded": exceeded,
+        "endpoints": dict(sorted(endpoints.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "filters", nargs="*", help="Run benchmarks whose name or group contains one"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--services", type=int, default=20, help="Services of the deployed apps"
+    )
+    parser.add_argument("--apps", type=int, default=1000, help="Apps in backplane.yml")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every API call"
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.005,
+        help="Seconds until a started container runs",
+    )
+    parser.add_argument(
+        "--endpoints", action="store_true", help="Show API calls per endpoint"
+    )
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    names = [
+        name
+        for name, (group, *_) in BENCHMARKS.items()
+        if not args.filters or any(f in name or f == group for f in args.filters)
+    ]
+
+    bench = Bench(args.services, args.apps, args.latency, args.delay)
+    results = []
+    try:
+        print(
+            f"{'benchmark':<24} {'min':>10} {'median':>10} {'api time':>10}"
+            f" {'api calls':>10} {'budget':>7}"
+        )
+        for name in names:
+            result = measure(bench, name, args.repeat, args.warmup)
+            results.append(result)
+            print(
+                f"{name:<24} {result['min_ms']:>7.2f} ms {result['median_ms']:>7.2f} ms"
+                f" {result['api_ms']:>7.2f} ms {result['api_calls']:>10}"
+                f" {result['api_budget'] if result['api_budget'] is not None else '-':>7}"
+            )
+            if result["api_budget_exceeded"]:
+                print(f"  {result['api_budget_exceeded']}")
+            if args.endpoints:
+                for endpoint, count in result["endpoints"].items():
+                    print(f"  {endpoint:<42} {count:>10}")
+    finally:
+        bench.close()
+
+    if args.json:
+        from backplane import __version__
+
+        args.json.write_text(
+            json.dumps(
+                {
+                    "version": __version__,
+                    "python": sys.version.split()[0],
+                    "services": args.services,
+                    "apps": args.apps,
+                    "latency": args.latency,
+                    "delay": args.delay,
+                    "results": results,
+                },
+                indent=4,
+            )
+        )
+
+    # Fail on N+1 regressions of the Docker API calls
+    if any(result["api_budget_exceeded"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
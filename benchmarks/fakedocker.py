@@ -0,0 +1,697 @@
+"""
+A stand-in for the Docker Engine API on a unix socket.
+
+Implements the part of the API backplane uses (containers, images,
+networks, volumes, events) in memory, without running anything. Every
+request is counted per endpoint so benchmarks can track API calls.
+
+    server = FakeDocker("/tmp/docker.sock").start()
+    os.environ["DOCKER_HOST"] = server.url
+"""
+import hashlib
+import itertools
+import json
+import os
+import queue
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, unquote, urlparse
+
+API_VERSION = "1.41"
+
+# Normalized endpoint -> regular expression of the path
+ROUTES = [
+    ("GET /_ping", r"/_ping"),
+    ("GET /version", r"/version"),
+    ("GET /info", r"/info"),
+    ("GET /events", r"/events"),
+    ("GET /containers/json", r"/containers/json"),
+    ("POST /containers/create", r"/containers/create"),
+    ("GET /containers/{id}/json", r"/containers/(?P<id>[^/]+)/json"),
+    ("POST /containers/{id}/start", r"/containers/(?P<id>[^/]+)/start"),
+    ("POST /containers/{id}/stop", r"/containers/(?P<id>[^/]+)/stop"),
+    ("POST /containers/{id}/restart", r"/containers/(?P<id>[^/]+)/restart"),
+    ("POST /containers/{id}/kill", r"/containers/(?P<id>[^/]+)/kill"),
+    ("DELETE /containers/{id}", r"/containers/(?P<id>[^/]+)"),
+    ("GET /images/{name}/json", r"/images/(?P<name>.+)/json"),
+    ("POST /images/create", r"/images/create"),
+    ("POST /images/{name}/tag", r"/images/(?P<name>.+)/tag"),
+    ("DELETE /images/{name}", r"/images/(?P<name>.+)"),
+    ("GET /networks", r"/networks"),
+    ("POST /networks/create", r"/networks/create"),
+    ("POST /networks/{id}/connect", r"/networks/(?P<id>[^/]+)/connect"),
+    ("GET /networks/{id}", r"/networks/(?P<id>[^/]+)"),
+    ("DELETE /networks/{id}", r"/networks/(?P<id>[^/]+)"),
+    ("GET /volumes", r"/volumes"),
+    ("POST /volumes/create", r"/volumes/create"),
+    ("GET /volumes/{name}", r"/volumes/(?P<name>[^/]+)"),
+    ("DELETE /volumes/{name}", r"/volumes/(?P<name>[^/]+)"),
+]
+ROUTES = [
+    (endpoint, endpoint.split(" ")[0], re.compile(pattern + "$"))
+    for endpoint, pattern in ROUTES
+]
+
+
+def digest(*parts):
+    return "sha256:" + hashlib.sha256("".join(parts).encode()).hexdigest()
+
+
+def image_name(reference: str):
+    # "traefik" -> "traefik:latest"
+    if "@" in reference or ":" in reference.rsplit("/", 1)[-1]:
+        return reference
+    return f"{reference}:latest"
+
+
+class NotFound(Exception):
+    pass
+
+
+class Conflict(Exception):
+    pass
+
+
+class State:
+    """
+    In-memory objects of the fake daemon. Containers start, die after a
+    kill and turn healthy delay seconds after the request, like processes
+    of a real daemon; stop and remove wait for the container. Every change
+    is published to the subscribers of /events.
+    """
+
+    def __init__(self, latency: float = 0.0, delay: float = 0.0):
+        self.latency = latency
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.closed = threading.Event()
+        self.ids = itertools.count(1)
+        self.containers = {}
+        self.images = {}
+        self.networks = {}
+        self.volumes = {}
+        self.calls = Counter()
+
+    def new_id(self):
+        return hashlib.sha256(str(next(self.ids)).encode()).hexdigest()
+
+    # Containers
+
+    def container(self, reference: str):
+        reference = reference.lstrip("/")
+        for container in self.containers.values():
+            if (
+                container["Id"].startswith(reference)
+                or container["Name"] == f"/{reference}"
+            ):
+                return container
+        raise NotFound(f"No such container: {reference}")
+
+    def create_container(self, name: str, body: dict):
+        image = self.image(body.get("Image", ""))
+        name = name or f"container_{next(self.ids)}"
+        if any(c["Name"] == f"/{name}" for c in self.containers.values()):
+            raise Conflict(f'Conflict. The container name "/{name}" is already in use')
+
+        host_config = body.pop("HostConfig", None) or {}
+        networking = (body.pop("NetworkingConfig", None) or {}).get(
+            "EndpointsConfig"
+        ) or {}
+        networks = {network: {"Aliases": None} for network in networking}
+        if not networks and host_config.get("NetworkMode"):
+            networks[host_config["NetworkMode"]] = {"Aliases": None}
+
+        mounts = []
+        for bind in host_config.get("Binds") or []:
+            source, destination, *mode = bind.split(":")
+            mounts.append(
+                {
+                    "Type": "bind" if source.startswith("/") else "volume",
+                    "Source": source,
+                    "Destination": destination,
+                    "RW": mode != ["ro"],
+                }
+            )
+
+        container = {
+            "Id": self.new_id(),
+            "Name": f"/{name}",
+            "Created": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "Image": image["Id"],
+            "Config": dict(body, Labels=body.get("Labels") or {}),
+            "HostConfig": host_config,
+            "Mounts": mounts,
+            "State": {"Status": "created", "Running": False, "ExitCode": 0},
+            "NetworkSettings": {"Networks": networks},
+        }
+        self.containers[container["Id"]] = container
+        self.publish(container, "create")
+        return container
+
+    def set_status(self, container: dict, status: str, exit_code: int = 0):
+        container["State"] = {
+            "Status": status,
+            "Running": status == "running",
+            "ExitCode": exit_code,
+        }
+
+    def later(self, function, *args):
+        # Run function under the lock once delay passed, like the daemon
+        # finishing a state change after answering the request
+        def run():
+            with self.lock:
+                function(*args)
+
+        if not self.delay:
+            function(*args)
+            return
+
+        timer = threading.Timer(self.delay, run)
+        timer.daemon = True
+        timer.start()
+
+    def start(self, container: dict, *actions):
+        if container["Id"] not in self.containers:
+            return
+        self.set_status(container, "running")
+        self.publish(container, *actions)
+
+        healthcheck = container["Config"].get("Healthcheck") or {}
+        if healthcheck.get("Test") and healthcheck["Test"] != ["NONE"]:
+            container["State"]["Health"] = {"Status": "starting"}
+            self.later(self.healthy, container)
+
+    def healthy(self, container: dict):
+        if container["State"].get("Health", {}).get("Status") == "starting":
+            container["State"]["Health"]["Status"] = "healthy"
+            self.publish(container, "health_status: healthy")
+
+    def stop(self, container: dict, exit_code: int, *actions):
+        if container["State"]["Running"]:
+            self.set_status(container, "exited", exit_code)
+            self.publish(container, *actions)
+
+    def remove(self, container: dict):
+        self.stop(container, 137, "kill", "die")
+        self.containers.pop(container["Id"])
+        self.publish(container, "destroy")
+
+    # Events
+
+    def subscribe(self, filters: dict):
+        events = queue.Queue()
+        self.subscribers.append((events, filters))
+        return events
+
+    def unsubscribe(self, events: queue.Queue):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s[0] is not events]
+
+    def publish(self, container: dict, *actions):
+        for action in actions:
+            now = time.time()
+            event = {
+                "status": action,
+                "id": container["Id"],
+                "from": container["Config"].get("Image"),
+                "Type": "container",
+                "Action": action,
+                "Actor": {
+                    "ID": container["Id"],
+                    "Attributes": dict(
+                        container["Config"]["Labels"],
+                        image=container["Config"].get("Image"),
+                        name=container["Name"].lstrip("/"),
+                    ),
+                },
+                "scope": "local",
+                "time": int(now),
+                "timeNano": int(now * 1e9),
+            }
+            for events, filters in self.subscribers:
+                if self.publishes(container, action, filters):
+                    events.put(event)
+
+    def publishes(self, container: dict, action: str, filters: dict):
+        if any(kind != "container" for kind in filters.get("type", [])):
+            return False
+        references = filters.get("container")
+        if references and not any(
+            container["Id"].startswith(reference)
+            or container["Name"] == f"/{reference.lstrip('/')}"
+            for reference in references
+        ):
+            return False
+        actions = filters.get("event")
+        if actions and action.split(":")[0] not in actions:
+            return False
+        return self.matches(container, {"label": filters.get("label", [])})
+
+    def summary(self, container: dict):
+        state = container["State"]
+        status = "Up 1 second" if state["Running"] else f"Exited ({state['ExitCode']})"
+        if state["Status"] == "created":
+            status = "Created"
+
+        return {
+            "Id": container["Id"],
+            "Names": [container["Name"]],
+            "Image": container["Config"].get("Image"),
+            "ImageID": container["Image"],
+            "Command": "",
+            "Created": 0,
+            "State": state["Status"],
+            "Status": status,
+            "Labels": container["Config"]["Labels"],
+            "Ports": [],
+            "Mounts": container["Mounts"],
+            "NetworkSettings": container["NetworkSettings"],
+        }
+
+    def list_containers(self, all: bool, filters: dict):
+        result = []
+        for container in self.containers.values():
+            if not all and not container["State"]["Running"]:
+                continue
+            if not self.matches(container, filters):
+                continue
+            result.append(self.summary(container))
+        return result
+
+    @staticmethod
+    def matches(container: dict, filters: dict):
+        labels = container["Config"]["Labels"]
+        for label in filters.get("label", []):
+            key, _, value = label.partition("=")
+            if key not in labels or (value and labels[key] != value):
+                return False
+        for name in filters.get("name", []):
+            if name.lstrip("/") not in container["Name"]:
+                return False
+        for status in filters.get("status", []):
+            if container["State"]["Status"] != status:
+                return False
+        return True
+
+    # Images
+
+    def image(self, reference: str):
+        name = image_name(unquote(reference))
+        for image in self.images.values():
+            if name in image["RepoTags"] or reference == image["Id"]:
+                return image
+            if any(d.endswith(name.rsplit("@", 1)[-1]) for d in image["RepoDigests"]):
+                if "@" in name:
+                    return image
+        raise NotFound(f"No such image: {reference}")
+
+    def add_image(self, reference: str):
+        name = image_name(reference)
+        repository = name.rsplit("@", 1)[0].rsplit(":", 1)[0]
+        image_id = digest("image", name)
+        image = self.images.setdefault(
+            image_id,
+            {
+                "Id": image_id,
+                "RepoTags": [],
+                "RepoDigests": [f"{repository}@{digest('manifest', name)}"],
+                "Size": 1000000,
+                "Config": {},
+            },
+        )
+        if "@" not in name and name not in image["RepoTags"]:
+            image["RepoTags"].append(name)
+        return image
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeDocker/" + API_VERSION
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return "unix"
+
+    @property
+    def state(self) -> State:
+        return self.server.state
+
+    def send(self, status: int, body=None):
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Api-Version", API_VERSION)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, items: list):
+        # Chunked JSON stream, like pulls and events
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for item in items:
+            data = json.dumps(item).encode() + b"\r\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def events(self, events: queue.Queue, until: float = None):
+        # Streams events until until passed, the client hung up or the
+        # daemon stops
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        try:
+            while not self.state.closed.is_set():
+                if self.hung_up():
+                    self.close_connection = True
+                    return
+                timeout = 0.05 if until is None else min(0.05, until - time.time())
+                if timeout <= 0:
+                    break
+                try:
+                    event = events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                data = json.dumps(event).encode() + b"\r\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        finally:
+            self.state.unsubscribe(events)
+
+    def hung_up(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.body()
+
+        for endpoint, method, pattern in ROUTES:
+            match = pattern.match(path)
+            if method == self.command and match:
+                break
+        else:
+            self.send(404, {"message": f"page not found: {self.command} {path}"})
+            return
+
+        with self.state.lock:
+            self.state.calls[endpoint] += 1
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        handler = getattr(self, "handle_" + re.sub(r"[\W_]+", "_", endpoint).strip("_"))
+        try:
+            with self.state.lock:
+                result = handler(query, body, **match.groupdict())
+        except NotFound as e:
+            self.send(404, {"message": str(e)})
+            return
+        except Conflict as e:
+            self.send(409, {"message": str(e)})
+            return
+
+        if isinstance(result, tuple) and result[0] == "stream":
+            self.stream(result[1])
+        elif isinstance(result, tuple) and result[0] == "events":
+            self.events(*result[1:])
+        elif isinstance(result, tuple):
+            self.send(*result)
+        else:
+            self.send(200, result)
+
+    @staticmethod
+    def filters(query: dict):
+        filters = json.loads(query.get("filters") or "{}")
+        # Both {"key": ["value"]} and {"key": {"value": true}} are valid
+        return {
+            key: list(value) if isinstance(value, (list, dict)) else [value]
+            for key, value in filters.items()
+        }
+
+    # Handlers, named after their endpoint
+
+    def handle_GET_ping(self, query, body):
+        return 200, "OK"
+
+    def handle_GET_version(self, query, body):
+        return {
+            "ApiVersion": API_VERSION,
+            "MinAPIVersion": "1.12",
+            "Version": "20.10.0-fake",
+            "Os": "linux",
+            "Arch": "amd64",
+        }
+
+    def handle_GET_info(self, query, body):
+        return {
+            "Containers": len(self.state.containers),
+            "Images": len(self.state.images),
+        }
+
+    def handle_GET_events(self, query, body):
+        # Subscribed under the lock, so no state change is missed. Past
+        # events aren't replayed, since is ignored
+        until = float(query["until"]) if query.get("until") else None
+        return "events", self.state.subscribe(self.filters(query)), until
+
+    def handle_GET_containers_json(self, query, body):
+        return self.state.list_containers(
+            query.get("all") in ("1", "true", "True"), self.filters(query)
+        )
+
+    def handle_POST_containers_create(self, query, body):
+        container = self.state.create_container(query.get("name"), body)
+        return 201, {"Id": container["Id"], "Warnings": []}
+
+    def handle_GET_containers_id_json(self, query, body, id):
+        return self.state.container(id)
+
+    def handle_POST_containers_id_start(self, query, body, id):
+        self.state.later(self.state.start, self.state.container(id), "start")
+        return 204, None
+
+    def handle_POST_containers_id_stop(self, query, body, id):
+        self.state.stop(self.state.container(id), 0, "kill", "die", "stop")
+        return 204, None
+
+    def handle_POST_containers_id_restart(self, query, body, id):
+        container = self.state.container(id)
+        self.state.stop(container, 0, "kill", "die", "stop")
+        self.state.later(self.state.start, container, "start", "restart")
+        return 204, None
+
+    def handle_POST_containers_id_kill(self, query, body, id):
+        container = self.state.container(id)
+        self.state.later(self.state.stop, container, 137, "kill", "die")
+        return 204, None
+
+    def handle_DELETE_containers_id(self, query, body, id):
+        container = self.state.container(id)
+        if container["State"]["Running"] and query.get("force") not in (
+            "1",
+            "true",
+            "True",
+        ):
+            raise Conflict("You cannot remove a running container")
+        self.state.remove(container)
+        return 204, None
+
+    def handle_GET_images_name_json(self, query, body, name):
+        return self.state.image(name)
+
+    def handle_POST_images_create(self, query, body):
+        reference = query["fromImage"]
+        tag = query.get("tag")
+        if tag:
+            reference += ("@" if tag.startswith("sha256:") else ":") + tag
+
+        self.state.add_image(reference)
+        layers = [digest("layer", reference, str(n))[7:19] for n in range(3)]
+
+        events = [{"status": f"Pulling from {query['fromImage']}", "id": tag or "latest"}]
+        for layer in layers:
+            events.append({"status": "Pulling fs layer", "id": layer})
+        for layer in layers:
+            events.append(
+                {
+                    "status": "Downloading",
+                    "id": layer,
+                    "progressDetail": {"current": 1000000, "total": 1000000},
+                }
+            )
+            events.append({"status": "Pull complete", "id": layer})
+        events.append({"status": f"Status: Downloaded newer image for {reference}"})
+        return "stream", events
+
+    def handle_POST_images_name_tag(self, query, body, name):
+        image = self.state.image(name)
+        tag = f"{query['repo']}:{query.get('tag') or 'latest'}"
+        if tag not in image["RepoTags"]:
+            image["RepoTags"].append(tag)
+        return 201, None
+
+    def handle_DELETE_images_name(self, query, body, name):
+        image = self.state.image(name)
+        tag = image_name(unquote(name))
+        if tag in image["RepoTags"] and len(image["RepoTags"]) > 1:
+            image["RepoTags"].remove(tag)
+        else:
+            self.state.images.pop(image["Id"])
+        return [{"Untagged": tag}]
+
+    def handle_GET_networks(self, query, body):
+        names = self.filters(query).get("name")
+        return [
+            network
+            for network in self.state.networks.values()
+            if not names or any(name in network["Name"] for name in names)
+        ]
+
+    def handle_POST_networks_create(self, query, body):
+        if any(n["Name"] == body["Name"] for n in self.state.networks.values()):
+            raise Conflict(f"network with name {body['Name']} already exists")
+        network = dict(body, Id=self.state.new_id(), Containers={})
+        self.state.networks[network["Id"]] = network
+        return 201, {"Id": network["Id"], "Warning": ""}
+
+    def network(self, reference: str):
+        for network in self.state.networks.values():
+            if network["Id"].startswith(reference) or network["Name"] == reference:
+                return network
+        raise NotFound(f"network {reference} not found")
+
+    def handle_POST_networks_id_connect(self, query, body, id):
+        network = self.network(id)
+        container = self.state.container(body["Container"])
+        container["NetworkSettings"]["Networks"][network["Name"]] = body.get(
+            "EndpointConfig"
+        ) or {"Aliases": None}
+        return 200, None
+
+    def handle_GET_networks_id(self, query, body, id):
+        return self.network(id)
+
+    def handle_DELETE_networks_id(self, query, body, id):
+        self.state.networks.pop(self.network(id)["Id"])
+        return 204, None
+
+    def handle_GET_volumes(self, query, body):
+        names = self.filters(query).get("name")
+        return {
+            "Volumes": [
+                volume
+                for volume in self.state.volumes.values()
+                if not names or any(name in volume["Name"] for name in names)
+            ],
+            "Warnings": None,
+        }
+
+    def handle_POST_volumes_create(self, query, body):
+        volume = self.state.volumes.setdefault(
+            body["Name"],
+            {
+                "Name": body["Name"],
+                "Driver": body.get("Driver") or "local",
+                "Labels": body.get("Labels") or {},
+                "Mountpoint": f"/var/lib/docker/volumes/{body['Name']}/_data",
+            },
+        )
+        return 201, volume
+
+    def handle_GET_volumes_name(self, query, body, name):
+        try:
+            return self.state.volumes[name]
+        except KeyError:
+            raise NotFound(f"get {name}: no such volume")
+
+    def handle_DELETE_volumes_name(self, query, body, name):
+        self.state.volumes.pop(name, None)
+        return 204, None
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Concurrent probes and waits connect at once
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled connections when they're closed
+        import sys
+
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeDocker:
+    """
+    The fake daemon, served from a background thread. latency adds a
+    delay to every request to approximate a real daemon, delay to every
+    container state change (see State).
+    """
+
+    def __init__(self, socket_path: str, latency: float = 0.0, delay: float = 0.0):
+        self.socket_path = str(socket_path)
+        self.state = State(latency, delay)
+        self.server = None
+
+    @property
+    def url(self):
+        return f"unix://{self.socket_path}"
+
+    @property
+    def calls(self):
+        return self.state.calls
+
+    def reset_calls(self):
+        with self.state.lock:
+            self.state.calls.clear()
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self.state.closed.clear()
+        self.server = Server(self.socket_path, Handler)
+        self.server.state = self.state
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.state.closed.set()
+            self.server.shutdown()
+            self.server.server_close()
+            os.unlink(self.socket_path)
+            self.server = None
@@ -55,6 +55,11 @@ then
   if [ "$?" = "0" ];
   then
     printf "\e[1;32m Started SSH server.\e[0m\n"
+
+    # Deployment queue for git pushes, runs as the user receiving them
+    sudo -u git -H /usr/local/bin/backplane deployd &
+    printf "\e[1;32m Started deployment queue.\e[0m\n"
+
     tail -f /dev/null
   else
     printf "\e[1;31m Failed to start SSH server. Terminating.\e[0m\n"
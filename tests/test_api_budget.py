@@ -0,0 +1,82 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fakedocker import FakeDocker  # noqa: E402
+
+# Containers take longer to start than the first poll intervals, so
+# waiting by polling instead of the events stream exceeds the budgets
+DELAY = 0.2
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    from docker.errors import DockerException
+
+    from backplane import __version__, docker_client, readiness
+    from backplane import main
+    from backplane.config import Config
+
+    docker = FakeDocker(tmp_path / "docker.sock", delay=DELAY).start()
+    docker.state.add_image("traefik:v2.3")
+    docker.state.add_image("portainer/portainer-ce:2.0.0")
+    docker.state.add_image(f"wearep3r/backplane:{__version__}")
+
+    monkeypatch.setenv("DOCKER_HOST", docker.url)
+    monkeypatch.setenv("BACKPLANE_CONFIG_DIR", str(tmp_path / "config"))
+    (tmp_path / "config" / "contexts" / "default").mkdir(parents=True)
+    monkeypatch.setattr(main, "conf", Config())
+
+    # Published ports don't exist on the fake daemon
+    wait_for_probe = readiness.wait_for_probe
+    monkeypatch.setattr(
+        readiness,
+        "wait_for_probe",
+        lambda probe, *args, **kwargs: not isinstance(probe, readiness.HealthcheckProbe)
+        or wait_for_probe(probe, *args, **kwargs),
+    )
+
+    docker_client.reset()
+    try:
+        docker_client.get_client().ping()
+    except DockerException as e:
+        docker.stop()
+        pytest.skip(f"Docker SDK can't talk to the fake daemon: {e}")
+
+    yield main
+
+    docker_client.reset()
+    docker.stop()
+
+
+def test_status(main, capsys):
+    from backplane import docker_client
+
+    main.up(service=None, restart=False, parallel=True)
+    capsys.readouterr()
+
+    # A single list of the containers, however many services
+    with docker_client.api_budget(1):
+        main.status(service=None, watch=False)
+
+    assert capsys.readouterr().out.count("running") == 3
+
+
+def test_up(main):
+    from backplane import docker_client
+
+    # 1 list, per core service: inspect the image, create and inspect,
+    # start, subscribe to its events, inspect after subscribing and after
+    # the start event
+    with docker_client.api_budget(
+        1 + 3 * 7, {"GET /events": 3, "GET /containers/{id}/json": 3 * 3}
+    ):
+        main.up(service=None, restart=False, parallel=True)
+
+    # Everything is running already
+    with docker_client.api_budget(1 + 3, {"POST /containers/{id}/start": 0}):
+        main.up(service=None, restart=False, parallel=True)
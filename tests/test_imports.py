@@ -0,0 +1,31 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def heavy_imports():
+    # Shared with make check-imports
+    makefile = (ROOT / "Makefile").read_text()
+    return re.search(r"^HEAVY_IMPORTS \?= (.+)$", makefile, re.M).group(1).split()
+
+
+def test_cli_import_is_lightweight(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backplane.main"],
+        cwd=ROOT,
+        env=dict(os.environ, BACKPLANE_CONFIG_DIR=str(tmp_path)),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    imported = {
+        line.rsplit("|", 1)[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+    assert imported & set(heavy_imports()) == set()